@@ -0,0 +1,86 @@
+import threading
+from time import perf_counter
+from queue import Queue, Empty
+from concurrent.futures import Future
+
+class MicroBatcher:
+	"""
+	Collects concurrent calls into batches processed by one worker thread.
+
+	A batch is closed when `maxBatchSize` items are queued or `maxWaitMs` has
+	passed since its first item arrived. `processBatch` receives the list of
+	items and returns one result per item; a result that is an exception is
+	raised in the caller that submitted that item.
+	"""
+
+	def __init__(self, processBatch, maxBatchSize=16, maxWaitMs=2):
+		self.processBatch = processBatch
+		self.maxBatchSize = maxBatchSize
+		self.maxWait = maxWaitMs / 1000
+		self.queue = Queue()
+
+		self.lock = threading.Lock()
+		self.batches = 0
+		self.items = 0
+		self.batchSizes = {}
+		self.queueWaitTotal = 0.0
+		self.queueWaitMax = 0.0
+		self.processTotal = 0.0
+
+		self.thread = threading.Thread(target=self.run, daemon=True)
+		self.thread.start()
+
+	def submit(self, item):
+		"""Queues an item and blocks until its batch has been processed."""
+
+		future = Future()
+		self.queue.put((item, future, perf_counter()))
+		return future.result()
+
+	def collect(self):
+		batch = [self.queue.get()]
+		deadline = perf_counter() + self.maxWait
+		while len(batch) < self.maxBatchSize:
+			remaining = deadline - perf_counter()
+			try:
+				batch.append(self.queue.get(timeout=remaining) if remaining > 0 else self.queue.get_nowait())
+			except Empty:
+				break
+		return batch
+
+	def run(self):
+		while True:
+			batch = self.collect()
+			start = perf_counter()
+
+			try:
+				results = self.processBatch([item for item, _, _ in batch])
+			except Exception as e:
+				results = [e] * len(batch)
+
+			for (_, future, _), result in zip(batch, results):
+				if isinstance(result, Exception):
+					future.set_exception(result)
+				else:
+					future.set_result(result)
+
+			waits = [start - enqueuedAt for _, _, enqueuedAt in batch]
+			with self.lock:
+				self.batches += 1
+				self.items += len(batch)
+				self.batchSizes[len(batch)] = self.batchSizes.get(len(batch), 0) + 1
+				self.queueWaitTotal += sum(waits)
+				self.queueWaitMax = max(self.queueWaitMax, max(waits))
+				self.processTotal += perf_counter() - start
+
+	def metrics(self):
+		with self.lock:
+			return {
+				'batches': self.batches,
+				'items': self.items,
+				'mean_batch_size': self.items / self.batches if self.batches else 0.0,
+				'batch_sizes': dict(sorted(self.batchSizes.items())),
+				'mean_queue_wait_ms': self.queueWaitTotal / self.items * 1000 if self.items else 0.0,
+				'max_queue_wait_ms': self.queueWaitMax * 1000,
+				'mean_batch_time_ms': self.processTotal / self.batches * 1000 if self.batches else 0.0,
+			}
@@ -0,0 +1,61 @@
+import threading
+from collections import OrderedDict
+
+class LRUCache:
+	"""
+	Thread-safe least-recently-used cache bounded by entry count and total size.
+
+	Args:
+		maxEntries (int): Maximum number of entries.
+		maxBytes (int): Maximum summed size of the entries, as reported by `sizeof`.
+		sizeof: Function returning the size in bytes of a value.
+	"""
+
+	def __init__(self, maxEntries=10000, maxBytes=64 * 2**20, sizeof=lambda value: 0):
+		self.maxEntries = maxEntries
+		self.maxBytes = maxBytes
+		self.sizeof = sizeof
+		self.entries = OrderedDict()
+		self.bytes = 0
+		self.lock = threading.Lock()
+
+		self.hits = 0
+		self.misses = 0
+		self.evictions = 0
+
+	def get(self, key):
+		with self.lock:
+			if key in self.entries:
+				self.entries.move_to_end(key)
+				self.hits += 1
+				return self.entries[key][0]
+			self.misses += 1
+			return None
+
+	def put(self, key, value):
+		size = self.sizeof(value)
+		if self.maxEntries <= 0 or size > self.maxBytes:
+			return
+
+		with self.lock:
+			if key in self.entries:
+				self.bytes -= self.entries.pop(key)[1]
+			self.entries[key] = (value, size)
+			self.bytes += size
+
+			while len(self.entries) > self.maxEntries or self.bytes > self.maxBytes:
+				_, (_, evictedSize) = self.entries.popitem(last=False)
+				self.bytes -= evictedSize
+				self.evictions += 1
+
+	def metrics(self):
+		with self.lock:
+			lookups = self.hits + self.misses
+			return {
+				'entries': len(self.entries),
+				'bytes': self.bytes,
+				'hits': self.hits,
+				'misses': self.misses,
+				'hit_rate': self.hits / lookups if lookups else 0.0,
+				'evictions': self.evictions,
+			}
@@ -0,0 +1,286 @@
+import numpy as np
+import faiss
+from sparse_index import concatenate_ranges
+
+# Document scores from chunk hits: the best chunk, or the sum of the best `topM` chunks
+DOCUMENT_SCORING = ("max", "sum")
+
+def aggregate_documents(distances, identifiers, documentMap, scoring="max", topM=3):
+	"""
+	Aggregates chunk-level hits of one query into ranked documents.
+
+	Args:
+		distances (np.ndarray): Chunk distances, in ascending order.
+		identifiers (np.ndarray): Chunk identifiers, -1 for missing hits.
+		documentMap (dict): Document of every chunk identifier.
+		scoring (str): "max" or "sum".
+		topM (int): Number of chunks summed per document when scoring is "sum".
+
+	Returns:
+		list: (document, score) tuples sorted by descending score.
+	"""
+
+	if scoring not in DOCUMENT_SCORING:
+		raise ValueError(f"Unknown document scoring: {scoring}")
+	limit = 1 if scoring == "max" else max(int(topM), 1)
+
+	documents = {}
+	for distance, identifier in zip(distances.tolist(), identifiers.tolist()):
+		if identifier < 0:
+			continue
+		scores = documents.setdefault(documentMap[identifier], [])
+		if len(scores) < limit:
+			scores.append(1 / (distance + 0.00000001))
+
+	results = [(document, sum(scores)) for document, scores in documents.items()]
+	if scoring == "sum":
+		# Stable, so ties keep the order of each document's best chunk
+		results.sort(key=lambda result: -result[1])
+	return results
+
+def unwrap_index(index):
+	"""
+	Finds the index beneath the `IndexIDMap`, `IndexRefine` and `IndexPreTransform` wrappers.
+
+	Returns:
+		tuple: The refine wrapper (None without one), whether an OPQ transform applies, and the inner index.
+	"""
+
+	inner = faiss.downcast_index(index.index) if isinstance(index, faiss.IndexIDMap) else faiss.downcast_index(index)
+
+	refine = None
+	if isinstance(inner, faiss.IndexRefine):
+		refine = inner
+		inner = faiss.downcast_index(inner.base_index)
+	transformed = isinstance(inner, faiss.IndexPreTransform)
+	if transformed:
+		inner = faiss.downcast_index(inner.index)
+	return refine, transformed, inner
+
+def is_mappable(index):
+	"""Whether the bulk of an index is memory-mapped: IVF inverted lists, or flat codes where FAISS supports it"""
+
+	_, _, inner = unwrap_index(index)
+	if isinstance(inner, faiss.IndexIVF):
+		return True
+	if not hasattr(faiss, "IO_FLAG_MMAP_IFC"):
+		return False
+	if isinstance(inner, faiss.IndexHNSW):
+		inner = faiss.downcast_index(inner.storage)
+	return isinstance(inner, faiss.IndexFlatCodes)
+
+def read_index(filepath, mmap=True):
+	"""
+	Reads a FAISS index, memory-mapping it where its type allows.
+
+	Memory-mapped inverted lists (IVF) and flat codes (SQ, including the
+	storage of HNSW-SQ) stay in the page cache, so processes that open the same
+	file share one copy. Other structures, such as HNSW graphs and coarse
+	quantizers, are still read into the heap.
+
+	Returns:
+		tuple: The index, and whether its bulk is memory-mapped.
+	"""
+
+	if mmap:
+		# Flat code mmap only exists in recent FAISS releases
+		flags = faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY | getattr(faiss, "IO_FLAG_MMAP_IFC", 0)
+		try:
+			index = faiss.read_index(filepath, flags)
+			return index, is_mappable(index)
+		except RuntimeError as e:
+			print(f"Cannot memory-map {filepath}, reading it into memory: {e}")
+	return faiss.read_index(filepath), False
+
+class DenseIndex:
+	"""
+	Wraps a FAISS index and applies per-request search effort for its type.
+
+	The type is detected beneath the `IndexIDMap`, `IndexRefine` and
+	`IndexPreTransform` (OPQ) wrappers: "ivf" indices (including IVF-PQ) take
+	`nprobe`, "hnsw" indices take `efSearch`, and "flat" indices ignore both.
+	Refined indices re-rank `k_factor` times more candidates of the base index
+	with their refine codes.
+
+	Args:
+		index: The loaded FAISS index.
+		nprobe (int): Default number of IVF lists probed.
+		efSearch (int): Default HNSW search queue size.
+	"""
+
+	def __init__(self, index, nprobe=None, efSearch=None):
+		self.index = index
+		self.refine, self.transformed, self.inner = unwrap_index(index)
+
+		if isinstance(self.inner, faiss.IndexIVF):
+			self.kind = "ivf"
+			if nprobe:
+				self.inner.nprobe = nprobe
+		elif isinstance(self.inner, faiss.IndexHNSW):
+			self.kind = "hnsw"
+			if efSearch:
+				self.inner.hnsw.efSearch = efSearch
+		else:
+			self.kind = "flat"
+
+	@property
+	def ntotal(self):
+		return self.index.ntotal
+
+	def describe(self):
+		return {
+			'kind': self.kind,
+			'type': type(self).__name__,
+			'dimension': self.index.d,
+			'opq': self.transformed,
+			'refine_k_factor': self.refine.k_factor if self.refine is not None else None,
+		}
+
+	def search_parameters(self, nprobe=None, efSearch=None):
+		if self.kind == "ivf" and nprobe:
+			params = faiss.SearchParametersIVF(nprobe=int(nprobe))
+		elif self.kind == "hnsw" and efSearch:
+			params = faiss.SearchParametersHNSW(efSearch=int(efSearch))
+		else:
+			return None
+
+		# Wrappers forward the parameters of the index beneath them, which must outlive the search
+		if self.transformed:
+			inner, params = params, faiss.SearchParametersPreTransform(index_params=params)
+			params.referenced_objects = [inner]
+		if self.refine is not None:
+			inner, params = params, faiss.IndexRefineSearchParameters(k_factor=self.refine.k_factor, base_index_params=params)
+			params.referenced_objects = [inner]
+		return params
+
+	def search(self, embeddings, k, nprobe=None, efSearch=None):
+		"""
+		Searches the index with optional per-request search effort.
+
+		Returns:
+			tuple: Distances and identifiers, as returned by FAISS.
+		"""
+
+		params = self.search_parameters(nprobe, efSearch)
+		if params is None:
+			return self.index.search(embeddings, k)
+		return self.index.search(embeddings, k, params=params)
+
+def truncate_embeddings(embeddings, dimension):
+	"""Shortens Matryoshka embeddings to their first `dimension` components and re-normalizes them"""
+	embeddings = np.ascontiguousarray(embeddings[:, :dimension], dtype=np.float32)
+	norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+	return embeddings / np.maximum(norms, 1e-12)
+
+class RescoredDenseIndex(DenseIndex):
+	"""
+	Dense index over truncated Matryoshka embeddings with full-dimension re-scoring.
+
+	The FAISS index holds the first `index.d` components of every chunk embedding
+	under the chunk's row number. Its top candidates are re-scored by exact L2
+	distance against the full embeddings, read from a memory-mapped float16
+	matrix, and mapped to their documents.
+
+	Args:
+		index: The loaded FAISS index over truncated embeddings.
+		vectorsPath (str): Path of the float16 matrix of full embeddings, one row per chunk.
+		chunkDocuments (np.ndarray): Document id of every chunk row.
+		dimension (int): Dimension of the full embeddings.
+		candidateFactor (int): Number of candidates re-scored per requested hit.
+		nprobe (int): Default number of IVF lists probed.
+		efSearch (int): Default HNSW search queue size.
+	"""
+
+	def __init__(self, index, vectorsPath, chunkDocuments, dimension, candidateFactor=4, nprobe=None, efSearch=None):
+		super().__init__(index, nprobe=nprobe, efSearch=efSearch)
+		self.vectors = np.memmap(vectorsPath, dtype=np.float16, mode="r").reshape(-1, dimension)
+		if len(self.vectors) != len(chunkDocuments):
+			raise ValueError(f"Full embeddings have {len(self.vectors)} rows for {len(chunkDocuments)} chunks")
+		self.chunkDocuments = chunkDocuments
+		self.candidateFactor = candidateFactor
+
+	def search(self, embeddings, k, nprobe=None, efSearch=None):
+		"""
+		Searches the truncated index, then re-ranks its candidates at full dimension.
+
+		Returns:
+			tuple: Full-dimension L2 distances and document identifiers, shaped like a FAISS result.
+		"""
+
+		embeddings = np.asarray(embeddings, dtype=np.float32)
+		_, candidates = super().search(truncate_embeddings(embeddings, self.index.d), k * self.candidateFactor, nprobe=nprobe, efSearch=efSearch)
+		return self.rescore(embeddings, [rows[rows >= 0] for rows in candidates], k)
+
+	def rescore(self, embeddings, candidateRows, k):
+		"""Ranks the candidate chunk rows of every query by exact L2 distance of the full embeddings"""
+
+		distances = np.full((len(embeddings), k), np.inf, dtype=np.float32)
+		identifiers = np.full((len(embeddings), k), -1, dtype=np.int64)
+		for i, rows in enumerate(candidateRows):
+			# Sorted rows turn the gather into a forward scan of the memory map
+			rows = np.sort(rows)
+			vectors = self.vectors[rows].astype(np.float32)
+			# |v|^2 - 2 v.q + |q|^2 avoids materializing the difference matrix
+			squared = np.einsum("ij,ij->i", vectors, vectors) - 2 * (vectors @ embeddings[i]) + embeddings[i] @ embeddings[i]
+			np.maximum(squared, 0, out=squared)
+			order = np.argsort(squared, kind="stable")[:k]
+			distances[i, :len(order)] = squared[order]
+			identifiers[i, :len(order)] = self.chunkDocuments[rows[order]]
+
+		return distances, identifiers
+
+class CentroidDenseIndex(RescoredDenseIndex):
+	"""
+	Two-tier dense index: document centroids first, then the chunks of the best documents.
+
+	The FAISS index holds one normalized centroid per document under the
+	document id. The `poolSize` nearest documents are retrieved, and only their
+	chunks are scored against the full embeddings, so search cost follows the
+	number of documents rather than the number of chunks.
+
+	Args:
+		index: The loaded FAISS index of document centroids.
+		vectorsPath (str): Path of the float16 matrix of full embeddings, one row per chunk.
+		chunkDocuments (np.ndarray): Document id of every chunk row.
+		dimension (int): Dimension of the full embeddings.
+		poolSize (int): Minimum number of candidate documents whose chunks are scored.
+		hitsPerDocument (int): Chunk hits requested per document by callers, which over-fetch chunks.
+		nprobe (int): Default number of IVF lists probed.
+		efSearch (int): Default HNSW search queue size.
+	"""
+
+	def __init__(self, index, vectorsPath, chunkDocuments, dimension, poolSize=100, hitsPerDocument=1, nprobe=None, efSearch=None):
+		super().__init__(index, vectorsPath, chunkDocuments, dimension, nprobe=nprobe, efSearch=efSearch)
+		self.poolSize = poolSize
+		self.hitsPerDocument = max(hitsPerDocument, 1)
+
+		# CSR layout of the chunk rows of every document
+		self.documentRows = np.argsort(chunkDocuments, kind="stable")
+		self.documentOffsets = np.zeros(int(chunkDocuments.max(initial=0)) + 2, dtype=np.int64)
+		self.documentOffsets[1:] = np.cumsum(np.bincount(chunkDocuments, minlength=len(self.documentOffsets) - 1))
+
+	@property
+	def ntotal(self):
+		return len(self.chunkDocuments)
+
+	def search(self, embeddings, k, nprobe=None, efSearch=None):
+		"""
+		Retrieves candidate documents by centroid, then ranks their chunks at full dimension.
+
+		At least as many documents as requested (k chunk hits over
+		`hitsPerDocument`) are scored, so that the hits can span them, while the
+		pool does not grow with the chunk over-fetch.
+
+		Returns:
+			tuple: Full-dimension L2 distances and document identifiers, shaped like a FAISS result.
+		"""
+
+		embeddings = np.asarray(embeddings, dtype=np.float32)
+		_, candidates = DenseIndex.search(self, truncate_embeddings(embeddings, self.index.d), max(self.poolSize, -(-k // self.hitsPerDocument)), nprobe=nprobe, efSearch=efSearch)
+
+		candidateRows = []
+		for documents in candidates:
+			documents = documents[(documents >= 0) & (documents < len(self.documentOffsets) - 1)]
+			starts = self.documentOffsets[documents]
+			candidateRows.append(self.documentRows[concatenate_ranges(starts, self.documentOffsets[documents + 1] - starts)])
+		return self.rescore(embeddings, candidateRows, k)
@@ -0,0 +1,150 @@
+import threading
+import zlib
+from os import path, makedirs, listdir, remove, replace, utime, getpid
+from hashlib import sha256
+from concurrent.futures import Future
+from collections import OrderedDict
+from cache import LRUCache
+
+class DocumentCache:
+	"""
+	Read-through cache of document texts on local disk, bounded by total bytes.
+
+	An in-memory LRU holds the hottest texts in front of a disk store of
+	optionally zlib-compressed files, evicted least recently used first once
+	their summed size exceeds `maxBytes`. Concurrent misses for one document
+	share a single fetch.
+
+	Args:
+		fetch: Function returning the text of a document.
+		directory (str): Directory of the disk store.
+		maxBytes (int): Maximum summed size of the files on disk.
+		memoryEntries (int): Maximum number of texts kept in memory.
+		memoryBytes (int): Maximum summed length of the texts kept in memory.
+		compress (bool): Whether files are compressed.
+	"""
+
+	def __init__(self, fetch, directory, maxBytes=2**30, memoryEntries=1000, memoryBytes=64 * 2**20, compress=True):
+		makedirs(directory, exist_ok=True)
+		self.fetch = fetch
+		self.directory = directory
+		self.maxBytes = maxBytes
+		self.compress = compress
+		self.extension = ".mmd.z" if compress else ".mmd"
+		self.lock = threading.Lock()
+
+		# Files left by earlier runs are reused, oldest first in eviction order
+		self.files = OrderedDict()
+		self.bytes = 0
+		filenames = [filename for filename in listdir(directory) if filename.endswith(self.extension)]
+		for filename in sorted(filenames, key=lambda filename: path.getmtime(path.join(directory, filename))):
+			self.files[filename] = path.getsize(path.join(directory, filename))
+			self.bytes += self.files[filename]
+
+		self.memory = LRUCache(maxEntries=memoryEntries, maxBytes=memoryBytes, sizeof=len)
+		self.inflight = {}
+
+		self.diskHits = 0
+		self.downloads = 0
+		self.coalesced = 0
+		self.evictions = 0
+
+	def get(self, documentId):
+		text = self.memory.get(documentId)
+		if text is not None:
+			return text
+
+		with self.lock:
+			future = self.inflight.get(documentId)
+			leader = future is None
+			if leader:
+				future = Future()
+				self.inflight[documentId] = future
+			else:
+				self.coalesced += 1
+
+		if not leader:
+			return future.result()
+
+		try:
+			text = self.read(documentId)
+			if text is None:
+				text = self.fetch(documentId)
+				with self.lock:
+					self.downloads += 1
+				self.write(documentId, text)
+			self.memory.put(documentId, text)
+			future.set_result(text)
+			return text
+		except Exception as e:
+			future.set_exception(e)
+			raise
+		finally:
+			with self.lock:
+				del self.inflight[documentId]
+
+	def filename(self, documentId):
+		return sha256(documentId.encode("utf-8")).hexdigest() + self.extension
+
+	def read(self, documentId):
+		filename = self.filename(documentId)
+		with self.lock:
+			if filename not in self.files:
+				return None
+			self.files.move_to_end(filename)
+
+		filepath = path.join(self.directory, filename)
+		try:
+			with open(filepath, "rb") as f:
+				data = f.read()
+			# Recency survives restarts through the modification time
+			utime(filepath)
+		except FileNotFoundError:
+			# Evicted by another worker sharing the directory
+			with self.lock:
+				self.bytes -= self.files.pop(filename, 0)
+			return None
+
+		with self.lock:
+			self.diskHits += 1
+		return (zlib.decompress(data) if self.compress else data).decode("utf-8")
+
+	def write(self, documentId, text):
+		data = text.encode("utf-8")
+		if self.compress:
+			data = zlib.compress(data, 6)
+		if len(data) > self.maxBytes:
+			return
+
+		filename = self.filename(documentId)
+		filepath = path.join(self.directory, filename)
+		# Workers sharing the directory may write the same document at once
+		partpath = f"{filepath}.{getpid()}-{threading.get_ident()}.part"
+		with open(partpath, "wb") as f:
+			f.write(data)
+		replace(partpath, filepath)
+
+		with self.lock:
+			self.bytes += len(data) - self.files.pop(filename, 0)
+			self.files[filename] = len(data)
+			while self.bytes > self.maxBytes:
+				evicted, size = self.files.popitem(last=False)
+				self.bytes -= size
+				self.evictions += 1
+				try:
+					remove(path.join(self.directory, evicted))
+				except FileNotFoundError:
+					pass
+
+	def metrics(self):
+		memory = self.memory.metrics()
+		with self.lock:
+			return {
+				'memory': memory,
+				'disk_entries': len(self.files),
+				'disk_bytes': self.bytes,
+				'disk_hits': self.diskHits,
+				'downloads': self.downloads,
+				'coalesced': self.coalesced,
+				'evictions': self.evictions,
+			}
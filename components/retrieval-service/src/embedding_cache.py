@@ -0,0 +1,152 @@
+import threading
+import sqlite3
+from os import path, makedirs
+from time import time
+from hashlib import sha256
+import numpy as np
+from cache import LRUCache
+
+# Key prefix of rows reserved by a writer whose vector is not written yet
+PENDING_PREFIX = "pending:"
+
+class EmbeddingCache:
+	"""
+	Two-tier cache of query embeddings that survives restarts.
+
+	An in-memory LRU sits in front of a disk store made of a memory-mapped
+	float16 matrix with `capacity` rows and a SQLite index from key to row.
+	Once the store is full, the oldest entry's row is reused. Rows are
+	allocated in SQLite write transactions, so workers sharing the directory
+	never claim the same row, and reserved under a pending key until their
+	vector is written, so a crash never exposes a partially written row. Reads
+	check that their key still owns the row once the vector is copied.
+
+	Args:
+		directory (str): Directory of the disk store.
+		dimension (int): Embedding dimension.
+		capacity (int): Number of embeddings kept on disk.
+		memoryEntries (int): Number of embeddings kept in memory.
+	"""
+
+	def __init__(self, directory, dimension, capacity=50000, memoryEntries=2000):
+		makedirs(directory, exist_ok=True)
+		self.dimension = dimension
+		self.capacity = capacity
+		self.lock = threading.Lock()
+
+		vectorsPath = path.join(directory, f"embeddings-{dimension}.f16")
+		mode = "r+" if path.exists(vectorsPath) and path.getsize(vectorsPath) == capacity * dimension * 2 else "w+"
+		self.vectors = np.memmap(vectorsPath, dtype=np.float16, mode=mode, shape=(capacity, dimension))
+
+		# Transactions are explicit, and writers of other workers are waited for instead of failing
+		self.conn = sqlite3.connect(path.join(directory, f"embeddings-{dimension}.db"), check_same_thread=False, timeout=30, isolation_level=None)
+		if mode == "w+":
+			self.conn.execute("DROP TABLE IF EXISTS entries")
+		self.conn.execute("""
+			CREATE TABLE IF NOT EXISTS entries (
+				key TEXT PRIMARY KEY,
+				row INTEGER UNIQUE,
+				created REAL
+			)
+		""")
+		self.conn.execute("CREATE INDEX IF NOT EXISTS idx_created ON entries (created)")
+
+		self.memory = LRUCache(maxEntries=memoryEntries, maxBytes=memoryEntries * dimension * 4, sizeof=lambda vector: vector.nbytes)
+		self.diskHits = 0
+		self.misses = 0
+
+	@staticmethod
+	def key(model, text):
+		return sha256(f"{model}\n{text}".encode("utf-8")).hexdigest()
+
+	def get(self, model, text):
+		key = self.key(model, text)
+		vector = self.memory.get(key)
+		if vector is not None:
+			return vector
+
+		with self.lock:
+			row = self.conn.execute("SELECT row FROM entries WHERE key = ?", (key,)).fetchone()
+			if row is not None:
+				vector = np.array(self.vectors[row[0]], dtype=np.float32)
+				# Another worker may have handed the row to a new key while it was read;
+				# rows are only overwritten after their old key is deleted, so an unchanged row is intact
+				if self.conn.execute("SELECT row FROM entries WHERE key = ?", (key,)).fetchone() != row:
+					row = None
+			if row is None:
+				self.misses += 1
+				return None
+			self.diskHits += 1
+
+		self.memory.put(key, vector)
+		return vector
+
+	def put(self, model, text, vector):
+		"""Stores an embedding; disk failures are logged, as the cache is only an optimization"""
+
+		key = self.key(model, text)
+		vector = np.asarray(vector, dtype=np.float32)
+		self.memory.put(key, vector)
+
+		with self.lock:
+			try:
+				row = self.reserve(key)
+				if row is None:
+					return
+				self.vectors[row] = vector.astype(np.float16)
+				self.vectors.flush()
+				self.conn.execute("BEGIN IMMEDIATE")
+				try:
+					self.conn.execute("UPDATE entries SET key = ? WHERE key = ?", (key, PENDING_PREFIX + key))
+				except sqlite3.IntegrityError:
+					# Another worker stored the same key meanwhile
+					self.conn.execute("DELETE FROM entries WHERE key = ?", (PENDING_PREFIX + key,))
+				self.conn.execute("COMMIT")
+			except (sqlite3.Error, OSError) as e:
+				if self.conn.in_transaction:
+					self.conn.execute("ROLLBACK")
+				print(f"Embedding cache write failed: {type(e).__name__}: {e}")
+
+	def reserve(self, key):
+		"""
+		Allocates the row of a new entry under its pending key.
+
+		Returns:
+			int: The row, or None when the key is already stored.
+		"""
+
+		self.conn.execute("BEGIN IMMEDIATE")
+		try:
+			if self.conn.execute("SELECT 1 FROM entries WHERE key = ?", (key,)).fetchone():
+				self.conn.execute("ROLLBACK")
+				return None
+
+			# Rows are allocated in order and only reused once all are taken, so they stay contiguous
+			nextRow = self.conn.execute("SELECT COALESCE(MAX(row) + 1, 0) FROM entries").fetchone()[0]
+			if nextRow < self.capacity:
+				row = nextRow
+			else:
+				oldestKey, row = self.conn.execute("SELECT key, row FROM entries ORDER BY created LIMIT 1").fetchone()
+				self.conn.execute("DELETE FROM entries WHERE key = ?", (oldestKey,))
+
+			self.conn.execute(
+				"INSERT OR REPLACE INTO entries (key, row, created) VALUES (?, ?, ?)",
+				(PENDING_PREFIX + key, row, time())
+			)
+			self.conn.execute("COMMIT")
+			return row
+		except BaseException:
+			self.conn.execute("ROLLBACK")
+			raise
+
+	def metrics(self):
+		memory = self.memory.metrics()
+		with self.lock:
+			lookups = memory['hits'] + self.diskHits + self.misses
+			return {
+				'memory': memory,
+				'disk_entries': self.conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0],
+				'disk_hits': self.diskHits,
+				'misses': self.misses,
+				'hit_rate': (memory['hits'] + self.diskHits) / lookups if lookups else 0.0,
+			}
@@ -0,0 +1,149 @@
+from os import getenv
+from time import perf_counter
+from json import dumps, loads
+from concurrent.futures import ThreadPoolExecutor
+from hashlib import sha256
+from openai import OpenAI
+from google import genai
+from data_types import Results
+from rate_limit import RateLimiters
+from retry import RetryPolicy, LatencyTracker, hedged_call
+
+EXTRACTION_PROMPT = "You are an expert at structured data extraction. You will be given unstructured text from a research paper and should extract the paper's results into the given structure. Extract an array of results achieved by the authors of the paper that are mentioned in the text (one or many). Do not include supplementary results at different, less optimal parameters. Each result's struct fields should contain minimal information and strictly adhere to the type."
+# Identifies the prompt and result schema, so that changing either invalidates cached extractions
+EXTRACTION_VERSION = sha256(f"{EXTRACTION_PROMPT}\n{dumps(Results.model_json_schema(), sort_keys=True)}".encode("utf-8")).hexdigest()[:16]
+
+# Requests and tokens per minute by model, e.g. {"gpt-5-mini": {"rpm": 500, "tpm": 500000}}
+EXTRACTION_RATE_LIMITS = loads(getenv("EXTRACTION_RATE_LIMITS", "{}"))
+# Rough prompt size estimate, as tokenizing every paper would cost more than the limiter saves
+CHARACTERS_PER_TOKEN = 4
+
+rateLimiters = RateLimiters(EXTRACTION_RATE_LIMITS)
+
+def estimate_prompt_tokens(sample):
+	return (len(EXTRACTION_PROMPT) + len(sample)) // CHARACTERS_PER_TOKEN
+
+# Retry policy shared by every LLM call site
+LLM_MAX_ATTEMPTS = int(getenv("LLM_MAX_ATTEMPTS", 5))
+LLM_RETRY_BASE_DELAY = float(getenv("LLM_RETRY_BASE_DELAY", 0.5))
+LLM_RETRY_MAX_DELAY = float(getenv("LLM_RETRY_MAX_DELAY", 30))
+
+# Optional hedged extraction: when an extraction takes longer than the given latency
+# percentile of its model, a second request is sent to EXTRACTION_HEDGE_MODEL on one
+# of EXTRACTION_HEDGE_WORKERS threads, while the first keeps its extraction thread
+EXTRACTION_HEDGE_MODEL = getenv("EXTRACTION_HEDGE_MODEL") or None
+EXTRACTION_HEDGE_PERCENTILE = float(getenv("EXTRACTION_HEDGE_PERCENTILE", 95))
+EXTRACTION_HEDGE_WORKERS = int(getenv("EXTRACTION_HEDGE_WORKERS", 32))
+
+OPENAI_MODELS = ["gpt-5", "gpt-5-mini", "gpt-5-nano"]
+GEMINI_MODELS = ["gemini-2.5-pro", "gemini-2.5-flash"]
+
+retryPolicy = RetryPolicy(maxAttempts=LLM_MAX_ATTEMPTS, baseDelay=LLM_RETRY_BASE_DELAY, maxDelay=LLM_RETRY_MAX_DELAY)
+extractionLatencies = LatencyTracker()
+hedgeExecutor = ThreadPoolExecutor(max_workers=EXTRACTION_HEDGE_WORKERS, thread_name_prefix="hedge")
+
+# LLM clients; retries are left to the shared retry policy
+openaiClient = OpenAI(max_retries=0)
+geminiClient = genai.Client()
+
+class ExtractionError(Exception):
+	pass
+
+def request_extraction(sample, model):
+	"""Sends one extraction request, returning the parsed results"""
+	if model in OPENAI_MODELS:
+		rateLimiters.get("openai", model).acquire(estimate_prompt_tokens(sample))
+		response = openaiClient.responses.parse(
+			model=model,
+			reasoning={"effort": "minimal"},
+			text={"verbosity": "low"},
+			input=[
+				{
+					"role": "system",
+					"content": EXTRACTION_PROMPT
+				},
+				{
+					"role": "user",
+					"content": sample
+				}
+			],
+			text_format=Results
+		)
+		return response.output_parsed.results
+	elif model in GEMINI_MODELS:
+		rateLimiters.get("gemini", model).acquire(estimate_prompt_tokens(sample))
+		response = geminiClient.models.generate_content(
+			model=model,
+			contents=f"{EXTRACTION_PROMPT}\n\nPaper: ```{sample}```",
+			config={
+				"response_mime_type": "application/json",
+				"response_schema": Results,
+			},
+		)
+		return response.parsed.results
+	raise ValueError(f"Unknown extraction model: {model}")
+
+def timed_extraction(sample, model, retries=None):
+	start = perf_counter()
+	output = retryPolicy.call(request_extraction, sample, model, maxAttempts=retries)
+	extractionLatencies.record(model, perf_counter() - start)
+	return output
+
+def extract_results_from(inputs, retries=None):
+	"""
+	Extracts the results of a paper, raising ExtractionError once every retry has failed.
+
+	Attempts default to the retry policy's LLM_MAX_ATTEMPTS. With a hedge model
+	configured, a slow extraction is backed by one from the hedge model, whose
+	result is used if the original fails.
+
+	Returns:
+		tuple: The results (None when the paper has none), and the model that produced them.
+	"""
+
+	sample, model = inputs
+	if model not in OPENAI_MODELS + GEMINI_MODELS:
+		raise ValueError(f"Unknown extraction model: {model}")
+
+	try:
+		threshold = extractionLatencies.percentile(model, EXTRACTION_HEDGE_PERCENTILE)
+		answeredBy = model
+		if EXTRACTION_HEDGE_MODEL is None or EXTRACTION_HEDGE_MODEL == model or threshold is None:
+			output = timed_extraction(sample, model, retries)
+		else:
+			output, hedged = hedged_call(
+				hedgeExecutor,
+				lambda: timed_extraction(sample, model, retries),
+				lambda: timed_extraction(sample, EXTRACTION_HEDGE_MODEL, retries),
+				threshold
+			)
+			if hedged:
+				answeredBy = EXTRACTION_HEDGE_MODEL
+				print(f"Extraction hedged to {EXTRACTION_HEDGE_MODEL} after {threshold:.1f}s")
+	except Exception as e:
+		print(e)
+		raise ExtractionError("Extraction failed") from e
+
+	if len(output) == 0:
+		return None, answeredBy
+
+	results = []
+	for result in output:
+		results.append({
+			"task": result.task,
+			"model_name": result.model_name,
+			"model_architecture": result.model_architecture,
+			"parameter_count": result.parameter_count,
+			"metric": result.metric,
+			"metric_higher_is_better": result.metric_higher_is_better,
+			"value": result.value,
+			"value_error": result.value_error,
+			"dataset": result.dataset,
+			"dataset_version": result.dataset_version,
+			"dataset_split": result.dataset_split,
+			"inference_time": result.inference_time,
+			"inference_time_unit": result.inference_time_unit,
+			"inference_device_class": result.inference_device_class
+		})
+
+	return results, answeredBy
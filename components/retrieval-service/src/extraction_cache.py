@@ -0,0 +1,101 @@
+import threading
+import sqlite3
+from json import dumps, loads
+from time import time
+
+class ExtractionCache:
+	"""
+	Persistent cache of structured extraction results.
+
+	Entries are keyed by (document, model, version), where the version
+	identifies the extraction prompt and result schema, so changing either one
+	makes earlier entries unreachable. `invalidate` deletes them in bulk.
+
+	Args:
+		filepath (str): Path of the SQLite database.
+		ttlSeconds (float): Age after which entries are ignored; None keeps them forever.
+	"""
+
+	def __init__(self, filepath, ttlSeconds=None):
+		self.ttlSeconds = ttlSeconds
+		self.lock = threading.Lock()
+
+		# Workers of one instance share the file, so writes wait for each other instead of failing
+		self.conn = sqlite3.connect(filepath, check_same_thread=False, timeout=30)
+		self.conn.execute("PRAGMA journal_mode = WAL")
+		self.conn.execute("""
+			CREATE TABLE IF NOT EXISTS extractions (
+				document_id TEXT,
+				model TEXT,
+				version TEXT,
+				results TEXT,
+				created REAL,
+				PRIMARY KEY (document_id, model, version)
+			)
+		""")
+		self.conn.commit()
+
+		self.hits = 0
+		self.misses = 0
+
+	def get(self, documentId, model, version):
+		"""
+		Returns:
+			tuple: Whether the entry was found, and the cached results (None when the document had none).
+		"""
+
+		with self.lock:
+			row = self.conn.execute(
+				"SELECT results, created FROM extractions WHERE document_id = ? AND model = ? AND version = ?",
+				(documentId, model, version)
+			).fetchone()
+			if row is None or (self.ttlSeconds and time() - row[1] > self.ttlSeconds):
+				self.misses += 1
+				return False, None
+			self.hits += 1
+			return True, loads(row[0])
+
+	def put(self, documentId, model, version, results):
+		with self.lock:
+			self.conn.execute(
+				"INSERT OR REPLACE INTO extractions (document_id, model, version, results, created) VALUES (?, ?, ?, ?, ?)",
+				(documentId, model, version, dumps(results), time())
+			)
+			self.conn.commit()
+
+	def invalidate(self, keepVersion=None, model=None, documentIds=None):
+		"""
+		Deletes entries in bulk: those of other versions than `keepVersion`, of
+		`model`, or of `documentIds`. Conditions combine, and no condition clears the cache.
+
+		Returns:
+			int: Number of deleted entries.
+		"""
+
+		conditions = []
+		params = []
+		if keepVersion is not None:
+			conditions.append("version != ?")
+			params.append(keepVersion)
+		if model is not None:
+			conditions.append("model = ?")
+			params.append(model)
+		if documentIds is not None:
+			conditions.append(f"document_id IN ({', '.join('?' * len(documentIds))})")
+			params.extend(documentIds)
+
+		where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+		with self.lock:
+			deleted = self.conn.execute(f"DELETE FROM extractions{where}", params).rowcount
+			self.conn.commit()
+		return deleted
+
+	def metrics(self):
+		with self.lock:
+			lookups = self.hits + self.misses
+			return {
+				'entries': self.conn.execute("SELECT COUNT(*) FROM extractions").fetchone()[0],
+				'hits': self.hits,
+				'misses': self.misses,
+				'hit_rate': self.hits / lookups if lookups else 0.0,
+			}
@@ -0,0 +1,66 @@
+import numpy as np
+
+# "rrf" ignores weights, "weighted-rrf" scales each list's reciprocal ranks, and
+# the CombSUM strategies add weighted, normalized raw scores
+FUSION_STRATEGIES = ("rrf", "weighted-rrf", "combsum-minmax", "combsum-zscore")
+
+def rank_map(results):
+	"""Rank (starting at 1) of every document in one pass, keeping its first occurrence."""
+
+	ranks = {}
+	for rank, (document, _) in enumerate(results, start=1):
+		ranks.setdefault(document, rank)
+	return ranks
+
+def normalize_scores(results, method):
+	"""Normalized score of every document, keeping its first occurrence."""
+
+	documents = {}
+	for document, score in results:
+		documents.setdefault(document, float(score))
+	if len(documents) == 0:
+		return documents
+
+	scores = np.fromiter(documents.values(), dtype=np.float64, count=len(documents))
+	if method == "minmax":
+		spread = scores.max() - scores.min()
+		# A list of equal scores still contributes its full weight
+		normalized = (scores - scores.min()) / spread if spread > 0 else np.ones_like(scores)
+	else:
+		deviation = scores.std()
+		normalized = (scores - scores.mean()) / deviation if deviation > 0 else np.zeros_like(scores)
+
+	return dict(zip(documents, normalized.tolist()))
+
+def fuse(resultLists, k, strategy="rrf", weights=None, rrfK=60):
+	"""
+	Fuses ranked result lists in time linear in their total length.
+
+	Args:
+		resultLists (dict): Name to ranked (document, score) tuples.
+		k (int): Number of fused results.
+		strategy (str): One of `FUSION_STRATEGIES`.
+		weights (dict): Name to weight; missing names weigh 1.
+		rrfK (float): Smoothing constant added to every rank by the RRF strategies.
+
+	Returns:
+		list: (document, score) tuples sorted by descending fused score.
+	"""
+
+	if strategy not in FUSION_STRATEGIES:
+		raise ValueError(f"Unknown fusion strategy: {strategy}")
+	weights = weights or {}
+
+	fusedScores = {}
+	for name, results in resultLists.items():
+		weight = 1.0 if strategy == "rrf" else float(weights.get(name, 1.0))
+		if strategy in ("rrf", "weighted-rrf"):
+			contributions = {document: 1.0 / (rrfK + rank) for document, rank in rank_map(results).items()}
+		else:
+			contributions = normalize_scores(results, strategy.split("-")[1])
+
+		for document, contribution in contributions.items():
+			fusedScores[document] = fusedScores.get(document, 0.0) + weight * contribution
+
+	# Stable, so ties keep the order in which documents were first seen
+	return sorted(fusedScores.items(), key=lambda x: x[1], reverse=True)[:k]
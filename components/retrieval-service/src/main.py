@@ -1,75 +1,264 @@
-from os import getenv, mkdir
+from os import getenv, makedirs, path, replace
 import sys
-from time import sleep
-import sqlite3
+import fcntl
+from time import perf_counter
 from datetime import datetime, timedelta
-from concurrent.futures import ThreadPoolExecutor
-import torch
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError, as_completed
+from json import dumps, loads
 import numpy as np
-import faiss
 import threading
-from flask import Flask, jsonify, request
-from transformers import AutoTokenizer, AutoModelForMaskedLM
-from openai import OpenAI
-from google import genai
+import resource
+from flask import Flask, Response, jsonify, request, stream_with_context
 from google.cloud import storage
 from traceback import print_exc
-from data_types import Results
+from extraction import openaiClient, rateLimiters, retryPolicy, extract_results_from, ExtractionError, EXTRACTION_VERSION
+from batching import MicroBatcher
+from cache import LRUCache
+from embedding_cache import EmbeddingCache
+from extraction_cache import ExtractionCache
+from document_cache import DocumentCache
+from dense_index import DenseIndex, RescoredDenseIndex, CentroidDenseIndex, DOCUMENT_SCORING, read_index, aggregate_documents
+from sqlite_pool import SqliteConnectionPool
+from fusion import FUSION_STRATEGIES, fuse
+from query_encoder import SpladeQueryEncoder, InferenceFreeQueryEncoder, configure_threads, compare_rankings, load_term_weights
+from sparse_index import InMemorySparseIndex, CompressedSparseIndex, BlobSparseIndex, SqliteSparseIndex, PROCESSORS, select_query_terms
 
 BUCKET_NAME = getenv("ML_PAPERS_BUCKET_NAME")
 storageClient = storage.Client()
 bucket = storageClient.bucket(BUCKET_NAME)
 
-# LLM clients
-openaiClient = OpenAI()
-geminiClient = genai.Client()
+# Sparse index backend: "memory" (NumPy posting lists), "compressed" (memory-mapped
+# impact-quantized index), "blob" (per-term posting BLOBs in SQLite) or "sqlite" (SQL join)
+SPARSE_INDEX_BACKEND = getenv("SPARSE_INDEX_BACKEND", "memory")
+# Query processor of the memory backend: "exhaustive", "maxscore" or "compare"
+SPARSE_QUERY_PROCESSOR = getenv("SPARSE_QUERY_PROCESSOR", "exhaustive")
+# Default query-term budget of sparse search, overridable per request (unset means unlimited)
+SPARSE_MAX_QUERY_TERMS = int(getenv("SPARSE_MAX_QUERY_TERMS", 0)) or None
+SPARSE_MIN_TERM_WEIGHT = float(getenv("SPARSE_MIN_TERM_WEIGHT", 0)) or None
+SPARSE_TERM_MASS_FRACTION = float(getenv("SPARSE_TERM_MASS_FRACTION", 1))
+# Read-only connections to the sparse index database shared by all requests
+SQLITE_POOL_SIZE = int(getenv("SQLITE_POOL_SIZE", 8))
+
+# Micro-batching of query encoding and dense search across concurrent requests
+QUERY_BATCH_MAX_SIZE = int(getenv("QUERY_BATCH_MAX_SIZE", 16))
+QUERY_BATCH_WAIT_MS = float(getenv("QUERY_BATCH_WAIT_MS", 2))
+
+# Default sparse query encoder: "splade" (model forward pass) or "inference-free"
+# (tokenizer and precomputed term weights), overridable per request
+SPARSE_QUERY_ENCODER = getenv("SPARSE_QUERY_ENCODER", "splade")
+SPARSE_QUERY_ENCODERS = ("splade", "inference-free")
+
+# Cache of SPLADE query vectors keyed by normalized query
+QUERY_CACHE_MAX_ENTRIES = int(getenv("QUERY_CACHE_MAX_ENTRIES", 10000))
+QUERY_CACHE_MAX_BYTES = int(getenv("QUERY_CACHE_MAX_BYTES", 64 * 2**20))
+
+# Default search effort of approximate dense indices, overridable per request
+DENSE_NPROBE = int(getenv("DENSE_NPROBE", 0)) or None
+DENSE_EF_SEARCH = int(getenv("DENSE_EF_SEARCH", 0)) or None
+
+# Aggregation of dense chunk hits into documents: chunks are first fetched at
+# DENSE_OVERFETCH per requested document, and the fetch is doubled until k unique
+# documents are found or DENSE_MAX_FETCH chunks have been fetched
+DENSE_DOCUMENT_SCORING = getenv("DENSE_DOCUMENT_SCORING", "max")
+DENSE_SCORING_TOP_M = int(getenv("DENSE_SCORING_TOP_M", 3))
+DENSE_OVERFETCH = int(getenv("DENSE_OVERFETCH", 4))
+DENSE_MAX_FETCH = int(getenv("DENSE_MAX_FETCH", 4096))
+
+# Memory-maps the dense index so that worker processes share it through the page cache
+DENSE_INDEX_MMAP = getenv("DENSE_INDEX_MMAP", "true").lower() == "true"
+
+# Candidates re-scored per hit when the dense index holds truncated Matryoshka embeddings
+DENSE_RESCORE_FACTOR = int(getenv("DENSE_RESCORE_FACTOR", 4))
+
+# Two-tier dense retrieval: a document centroid index selects at least
+# DENSE_CENTROID_POOL documents, whose chunks are then scored
+DENSE_CENTROID_INDEX = getenv("DENSE_CENTROID_INDEX", "false").lower() == "true"
+DENSE_CENTROID_POOL = int(getenv("DENSE_CENTROID_POOL", 100))
+
+# Hybrid search runs its sparse and dense legs concurrently on a shared executor.
+# A leg that misses its deadline is dropped under the "partial" policy, so the
+# response uses the other leg, or fails the request under the "fail" policy
+SEARCH_EXECUTOR_WORKERS = int(getenv("SEARCH_EXECUTOR_WORKERS", 16))
+HYBRID_SPARSE_TIMEOUT_MS = float(getenv("HYBRID_SPARSE_TIMEOUT_MS", 5000))
+HYBRID_DENSE_TIMEOUT_MS = float(getenv("HYBRID_DENSE_TIMEOUT_MS", 5000))
+HYBRID_DEGRADE_POLICY = getenv("HYBRID_DEGRADE_POLICY", "partial")
+
+# Default fusion of the hybrid legs, overridable per request
+FUSION_STRATEGY = getenv("FUSION_STRATEGY", "rrf")
+FUSION_RRF_K = float(getenv("FUSION_RRF_K", 60))
+FUSION_SPARSE_WEIGHT = float(getenv("FUSION_SPARSE_WEIGHT", 1))
+FUSION_DENSE_WEIGHT = float(getenv("FUSION_DENSE_WEIGHT", 1))
+
+# Persistent cache of OpenAI query embeddings
+EMBEDDING_MODEL = "text-embedding-3-large"
+EMBEDDING_DIMENSIONS = 3072
+EMBEDDING_CACHE_DIR = getenv("EMBEDDING_CACHE_DIR", "./embedding_cache")
+EMBEDDING_CACHE_CAPACITY = int(getenv("EMBEDDING_CACHE_CAPACITY", 50000))
+EMBEDDING_CACHE_MEMORY_ENTRIES = int(getenv("EMBEDDING_CACHE_MEMORY_ENTRIES", 2000))
+
+# SPLADE query encoder backend ("fp32", "int8", "compile", "trace" or combinations
+# such as "int8+trace") and torch thread settings
+QUERY_ENCODER_BACKEND = getenv("QUERY_ENCODER_BACKEND", "fp32")
+QUERY_ENCODER_VERIFY = getenv("QUERY_ENCODER_VERIFY", "false").lower() == "true"
+TORCH_NUM_THREADS = int(getenv("TORCH_NUM_THREADS", 0)) or None
+TORCH_NUM_INTEROP_THREADS = int(getenv("TORCH_NUM_INTEROP_THREADS", 0)) or None
+
+# Persistent cache of extraction results; entries of earlier prompt or schema versions are deleted at startup
+EXTRACTION_CACHE_PATH = getenv("EXTRACTION_CACHE_PATH", "./extraction_cache.db")
+EXTRACTION_CACHE_TTL = float(getenv("EXTRACTION_CACHE_TTL", 0)) or None
+
+# Process-wide cap on concurrent extractions across all requests
+EXTRACTION_CONCURRENCY = int(getenv("EXTRACTION_CONCURRENCY", 32))
+
+# Local cache of corrected markdown texts: compressed files on disk bounded by
+# total bytes, behind an in-memory LRU of the hottest documents
+MMD_CACHE_DIR = getenv("MMD_CACHE_DIR", "./mmd_cache")
+MMD_CACHE_MAX_BYTES = int(getenv("MMD_CACHE_MAX_BYTES", 2**30))
+MMD_CACHE_MEMORY_ENTRIES = int(getenv("MMD_CACHE_MEMORY_ENTRIES", 500))
+MMD_CACHE_MEMORY_BYTES = int(getenv("MMD_CACHE_MEMORY_BYTES", 64 * 2**20))
+MMD_CACHE_COMPRESS = getenv("MMD_CACHE_COMPRESS", "true").lower() == "true"
 
 # Global variables for indices and models
-conn = None
-cursor = None
-tokenizer = None
-model = None
+sqlitePool = None
+sparseIndex = None
+queryEncoder = None
+queryEncoderCheck = None
+inferenceFreeEncoder = None
 denseIndex = None
 indexDocumentMap = None
+denseIndexLoad = None
+precomputedExtractions = False
 serviceReady = False
 
+def download_blob(blob, filepath):
+	"""
+	Downloads a blob once per instance.
+
+	Workers starting together take a file lock, so one downloads while the
+	others wait, and the file only appears under its name once complete.
+	Sharing the file lets memory-mapped indices share the page cache.
+	"""
+
+	with open(f"{filepath}.lock", "w") as lock:
+		fcntl.flock(lock, fcntl.LOCK_EX)
+		if path.exists(filepath):
+			print(f"Found {filepath}")
+			return
+		print(f"Downloading {filepath}")
+		blob.download_to_filename(f"{filepath}.part")
+		replace(f"{filepath}.part", filepath)
+		print(f"Loaded {filepath}")
+
+def resident_memory():
+	"""Resident set size of this process in bytes"""
+	try:
+		with open("/proc/self/statm") as f:
+			return int(f.read().split()[1]) * resource.getpagesize()
+	except OSError:
+		return None
+
 def download_resources():
-	global conn, cursor, tokenizer, model, denseIndex, indexDocumentMap, serviceReady
+	global sqlitePool, sparseIndex, queryEncoder, queryEncoderCheck, inferenceFreeEncoder, denseIndex, denseIndexLoad, indexDocumentMap, precomputedExtractions, serviceReady
 
 	try:
 		# Download and load sparse index
 		SPARSE_INDEX_PATH = "sparse_index.db"
-		print(f"Downloading {SPARSE_INDEX_PATH}")
-		bucket.blob(f"Index/{SPARSE_INDEX_PATH}").download_to_filename(SPARSE_INDEX_PATH)
-		print(f"Loaded {SPARSE_INDEX_PATH}")
-		conn = sqlite3.connect(f"./{SPARSE_INDEX_PATH}", check_same_thread=False)
-		cursor = conn.cursor()
+		download_blob(bucket.blob(f"Index/{SPARSE_INDEX_PATH}"), SPARSE_INDEX_PATH)
+		sqlitePool = SqliteConnectionPool(f"./{SPARSE_INDEX_PATH}", maxConnections=SQLITE_POOL_SIZE)
+		if SPARSE_INDEX_BACKEND == "sqlite":
+			sparseIndex = SqliteSparseIndex(sqlitePool)
+		elif SPARSE_INDEX_BACKEND == "blob":
+			sparseIndex = BlobSparseIndex(sqlitePool)
+		elif SPARSE_INDEX_BACKEND == "compressed":
+			COMPRESSED_INDEX_PATH = "sparse_index.spx"
+			download_blob(bucket.blob(f"Index/{COMPRESSED_INDEX_PATH}"), COMPRESSED_INDEX_PATH)
+			sparseIndex = CompressedSparseIndex(f"./{COMPRESSED_INDEX_PATH}")
+		else:
+			with sqlitePool.connection() as conn:
+				sparseIndex = InMemorySparseIndex.from_sqlite(conn)
+		print(f"Loaded sparse index ({SPARSE_INDEX_BACKEND})")
 
 		# Global model initialization
 		MODEL_NAME = "splade-cocondenser-ensembledistil"
 		blobs = bucket.list_blobs(prefix=f"Models/{MODEL_NAME}")
-		mkdir(f"./{MODEL_NAME}")
+		makedirs(f"./{MODEL_NAME}", exist_ok=True)
+		weightBlobs = []
 		for blob in blobs:
 			filepath = f"./{MODEL_NAME}/{blob.name.split('/')[-1]}"
-			print(f"Downloading {filepath}")
-			blob.download_to_filename(filepath)
-			print(f"Loaded {filepath}")
-		tokenizer = AutoTokenizer.from_pretrained(f"./{MODEL_NAME}")
-		model = AutoModelForMaskedLM.from_pretrained(f"./{MODEL_NAME}", device_map="auto")
-		model.eval()
+			if filepath.endswith((".safetensors", ".bin", ".pt")):
+				weightBlobs.append((blob, filepath))
+				continue
+			download_blob(blob, filepath)
+
+		# Inference-free encoding only needs the tokenizer, so it is served while the model loads
+		with sqlitePool.connection() as conn:
+			inferenceFreeEncoder = InferenceFreeQueryEncoder(f"./{MODEL_NAME}", load_term_weights(conn))
+		print("Loaded inference-free query encoder")
+
+		for blob, filepath in weightBlobs:
+			download_blob(blob, filepath)
+		configure_threads(TORCH_NUM_THREADS, TORCH_NUM_INTEROP_THREADS)
+		queryEncoder = SpladeQueryEncoder(f"./{MODEL_NAME}", backend=QUERY_ENCODER_BACKEND)
+		print(f"Loaded query encoder ({QUERY_ENCODER_BACKEND})")
+
+		if QUERY_ENCODER_VERIFY and QUERY_ENCODER_BACKEND != "fp32":
+			queryEncoderCheck = compare_rankings(
+				queryEncoder,
+				SpladeQueryEncoder(f"./{MODEL_NAME}"),
+				lambda terms, weights, k: sparseIndex.search(terms, weights, k)[0]
+			)
+			print(f"Query encoder check against fp32: {queryEncoderCheck}")
 
 		# Download and load dense index
-		DENSE_INDEX_PATH = "dense_index.faiss"
-		print(f"Downloading {DENSE_INDEX_PATH}")
-		bucket.blob(f"Index/{DENSE_INDEX_PATH}").download_to_filename(DENSE_INDEX_PATH)
-		print(f"Loaded {DENSE_INDEX_PATH}")
-		denseIndex = faiss.read_index(f"./{DENSE_INDEX_PATH}")
+		DENSE_INDEX_PATH = "dense_centroid_index.faiss" if DENSE_CENTROID_INDEX else "dense_index.faiss"
+		download_blob(bucket.blob(f"Index/{DENSE_INDEX_PATH}"), DENSE_INDEX_PATH)
+		start = perf_counter()
+		residentBefore = resident_memory()
+		index, mmapped = read_index(f"./{DENSE_INDEX_PATH}", mmap=DENSE_INDEX_MMAP)
+		if DENSE_CENTROID_INDEX or index.d < EMBEDDING_DIMENSIONS:
+			# Centroid hits and truncated embeddings are re-scored against the full embeddings of chunks
+			for filepath in ["dense_vectors.f16", "dense_vector_documents.npy"]:
+				download_blob(bucket.blob(f"Index/{filepath}"), filepath)
+		if DENSE_CENTROID_INDEX:
+			denseIndex = CentroidDenseIndex(
+				index,
+				"./dense_vectors.f16",
+				np.load("./dense_vector_documents.npy"),
+				EMBEDDING_DIMENSIONS,
+				poolSize=DENSE_CENTROID_POOL,
+				hitsPerDocument=DENSE_OVERFETCH,
+				nprobe=DENSE_NPROBE,
+				efSearch=DENSE_EF_SEARCH
+			)
+		elif index.d < EMBEDDING_DIMENSIONS:
+			denseIndex = RescoredDenseIndex(
+				index,
+				"./dense_vectors.f16",
+				np.load("./dense_vector_documents.npy"),
+				EMBEDDING_DIMENSIONS,
+				candidateFactor=DENSE_RESCORE_FACTOR,
+				nprobe=DENSE_NPROBE,
+				efSearch=DENSE_EF_SEARCH
+			)
+		else:
+			denseIndex = DenseIndex(index, nprobe=DENSE_NPROBE, efSearch=DENSE_EF_SEARCH)
+		residentAfter = resident_memory()
+		denseIndexLoad = {
+			'mmap': mmapped,
+			'load_seconds': perf_counter() - start,
+			'resident_bytes_added': residentAfter - residentBefore if residentAfter is not None else None,
+		}
+		print(f"Loaded dense index ({denseIndex.kind}, {index.d} dimensions, {denseIndex.ntotal} vectors) in {denseIndexLoad['load_seconds']:.2f}s, mmap {mmapped}")
+		print(f"Resident memory: {residentAfter} bytes, {denseIndexLoad['resident_bytes_added']} added by the dense index")
 
 		# Load dense index and create document mapping
-		cursor.execute("SELECT id, filename FROM documents")
-		documents = cursor.fetchall()
+		documents = sqlitePool.fetchall("SELECT id, filename FROM documents")
 		indexDocumentMap = {row[0]: row[1] for row in documents}
 
+		# Extraction results backfilled offline into the index bundle, if any
+		precomputedExtractions = len(sqlitePool.fetchall("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'extractions'")) > 0
+		print(f"Precomputed extractions: {precomputedExtractions}")
+
 		print("All resources downloaded and loaded successfully")
 		serviceReady = True
 
@@ -83,9 +272,10 @@ downloadThread.start()
 
 app = Flask(__name__)
 
-def check_service_ready():
+def check_service_ready(encoder=None):
 	"""Check if service is ready, return 503 if not"""
-	if not serviceReady:
+	ready = inferenceFreeEncoder is not None if encoder == "inference-free" else serviceReady
+	if not ready:
 		return jsonify({'error': 'Service is starting, please try again later'}), 503
 	return None
 
@@ -99,174 +289,334 @@ def download_processed_mmd_file(filename):
 	md = blob.download_as_bytes().decode("utf-8")
 	return md
 
-def extract_results_from(inputs, retries=5):
-	if retries == 0:
-		return None
-
-	sample, model = inputs
-	try:
-		if model in ["gpt-5", "gpt-5-mini", "gpt-5-nano"]:
-			response = openaiClient.responses.parse(
-				model=model,
-				reasoning={"effort": "minimal"},
-				text={"verbosity": "low"},
-				input=[
-					{
-						"role": "system",
-						"content": "You are an expert at structured data extraction. You will be given unstructured text from a research paper and should extract the paper's results into the given structure. Extract an array of results achieved by the authors of the paper that are mentioned in the text (one or many). Do not include supplementary results at different, less optimal parameters. Each result's struct fields should contain minimal information and strictly adhere to the type."
-					},
-					{
-						"role": "user",
-						"content": sample
-					}
-				],
-				text_format=Results
-			)
-			output = response.output_parsed.results
-		elif model in ["gemini-2.5-pro", "gemini-2.5-flash"]:
-			response = geminiClient.models.generate_content(
-				model=model,
-				contents=f"You are an expert at structured data extraction. You will be given unstructured text from a research paper and should extract the paper's results into the given structure. Extract an array of results achieved by the authors of the paper that are mentioned in the text (one or many). Do not include supplementary results at different, less optimal parameters. Each result's struct fields should contain minimal information and strictly adhere to the type.\n\nPaper: ```{sample}```",
-				config={
-					"response_mime_type": "application/json",
-					"response_schema": Results,
-				},
-			)
-			output = response.parsed
-	except Exception as e:
-		print(e)
-		sleep(5)
-		return extract_results_from(inputs, retries=retries - 1)
-
-	if len(output) == 0:
-		return None
-
-	results = []
-	for result in output:
-		results.append({
-			"task": result.task,
-			"model_name": result.model_name,
-			"model_architecture": result.model_architecture,
-			"parameter_count": result.parameter_count,
-			"metric": result.metric,
-			"metric_higher_is_better": result.metric_higher_is_better,
-			"value": result.value,
-			"value_error": result.value_error,
-			"dataset": result.dataset,
-			"dataset_version": result.dataset_version,
-			"dataset_split": result.dataset_split,
-			"inference_time": result.inference_time,
-			"inference_time_unit": result.inference_time_unit,
-			"inference_device_class": result.inference_device_class
-		})
-
-	return results
+def precomputed_extractions(filenames, model="gpt-5-mini"):
+	"""Backfilled extraction results of the given documents for the current prompt version"""
+	if not precomputedExtractions or len(filenames) == 0:
+		return {}
+
+	rows = sqlitePool.fetchall(
+		f"""
+		SELECT d.filename, e.results
+		FROM extractions e
+		JOIN documents d ON d.id = e.document_id
+		WHERE e.model = ? AND e.version = ? AND d.filename IN ({', '.join('?' * len(filenames))})
+		""",
+		(model, EXTRACTION_VERSION, *filenames)
+	)
+	return {filename: loads(results) for filename, results in rows}
 
 def extract_results(filenames, model="gpt-5-mini"):
-	with ThreadPoolExecutor() as executor:
-		texts = list(executor.map(download_processed_mmd_file, filenames))
-		results = list(executor.map(extract_results_from, [(text, model) for text in texts]))
+	# Only documents that have not been backfilled are extracted live
+	precomputed = precomputed_extractions(filenames, model)
+	missing = [filename for filename in filenames if filename not in precomputed]
+	extracted = dict(zip(missing, extractionExecutor.map(extract_document, missing, [model] * len(missing))))
+	return [precomputed[filename] if filename in precomputed else extracted[filename] for filename in filenames]
+
+def extract_document(filename, model="gpt-5-mini"):
+	"""Extracts the results of a document through the extraction cache; failed extractions are not cached"""
+	found, results = extractionCache.get(filename, model, EXTRACTION_VERSION)
+	if found:
 		return results
 
-def search_index(query, k):
-	tokens = tokenizer(query, return_tensors='pt', padding=False, truncation=False)
-	if tokens['input_ids'].shape[1] > 512:
-		raise ValueError("Input text is too long")
-
-	tokens = {k: v.to(model.device) for k, v in tokens.items()}
-
-	with torch.no_grad():
-		outputs = model(**tokens)
-
-	vector = torch.max(
-		torch.log(1 + torch.relu(outputs.logits)) * tokens['attention_mask'].unsqueeze(-1),
-		dim=1
-	)[0].squeeze()
+	try:
+		results, answeredBy = extract_results_from((documentCache.get(filename), model))
+	except ExtractionError:
+		return None
+	# Hedged results are cached under the hedge model, so they never answer for the requested one
+	extractionCache.put(filename, answeredBy, EXTRACTION_VERSION, results)
+	return results
 
-	indices = vector.nonzero().squeeze().cpu().tolist()
-	if not isinstance(indices, list):
-		indices = [indices]
+def stream_mode(data):
+	"""Reads the streaming mode of a search request: None, "ndjson" or "sse" """
+	stream = data.get('stream')
+	if stream is None or stream is False:
+		return None
+	if stream is True:
+		return "sse" if "text/event-stream" in request.headers.get("Accept", "") else "ndjson"
+	if stream in ("ndjson", "sse"):
+		return stream
+	raise ValueError(f"Unknown stream mode: {stream}")
+
+def stream_search_results(searchResults, extras, mode, model="gpt-5-mini"):
+	"""
+	Streams ranked hits immediately, then the extracted data of each document as it completes.
+
+	Events are "results" (the ranking and `extras`), one "extracted_data" per
+	document in completion order, and "done". NDJSON lines carry the event name
+	in an `event` field; Server-Sent Events use the event line.
+	"""
+
+	def event(name, payload):
+		if mode == "sse":
+			return f"event: {name}\ndata: {dumps(payload)}\n\n"
+		return dumps({'event': name, **payload}) + "\n"
+
+	def generate():
+		yield event('results', {
+			'results': [
+				{'rank': rank, 'document_id': filename, 'score': float(score)}
+				for rank, (filename, score) in enumerate(searchResults)
+			],
+			**extras
+		})
 
-	if len(indices) == 0:
-		return []
+		precomputed = precomputed_extractions([filename for filename, _ in searchResults], model)
+		for rank, (filename, _) in enumerate(searchResults):
+			if filename in precomputed:
+				yield event('extracted_data', {'rank': rank, 'document_id': filename, 'extracted_data': precomputed[filename]})
+
+		futures = {}
+		try:
+			futures = {
+				extractionExecutor.submit(extract_document, filename, model): rank
+				for rank, (filename, _) in enumerate(searchResults)
+				if filename not in precomputed
+			}
+			for future in as_completed(futures):
+				rank = futures[future]
+				payload = {'rank': rank, 'document_id': searchResults[rank][0]}
+				try:
+					payload['extracted_data'] = future.result()
+				except Exception:
+					print_exc()
+					payload['extracted_data'] = None
+					payload['error'] = 'Extraction failed'
+				yield event('extracted_data', payload)
+			yield event('done', {})
+		finally:
+			# Pending extractions are dropped when the client disconnects
+			for future in futures:
+				future.cancel()
+
+	return Response(
+		stream_with_context(generate()),
+		mimetype="text/event-stream" if mode == "sse" else "application/x-ndjson",
+		headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+	)
 
-	weights = vector[indices].cpu().tolist()
+def encode_queries(queries):
+	return queryEncoder.encode(queries)
+
+def normalize_query(query):
+	# The SPLADE tokenizer is uncased, so casing and whitespace do not change the encoding
+	return " ".join(query.split()).lower()
+
+def encode_query(query, encoder="splade"):
+	if encoder == "inference-free":
+		vector = inferenceFreeEncoder.encode([query])[0]
+		if isinstance(vector, Exception):
+			raise vector
+		return vector
+
+	key = normalize_query(query)
+	vector = queryVectorCache.get(key)
+	if vector is None:
+		indices, weights = queryEncoderBatcher.submit(key)
+		vector = (np.array(indices, dtype=np.int32), np.array(weights, dtype=np.float32))
+		queryVectorCache.put(key, vector)
+	return vector
+
+def query_term_budget(data):
+	"""Reads the per-request query-term budget, falling back to the service defaults"""
+	try:
+		maxTerms = data.get('max_query_terms', SPARSE_MAX_QUERY_TERMS)
+		minWeight = data.get('min_term_weight', SPARSE_MIN_TERM_WEIGHT)
+		massFraction = data.get('term_mass_fraction', SPARSE_TERM_MASS_FRACTION)
+		budget = {
+			'maxTerms': int(maxTerms) if maxTerms is not None else None,
+			'minWeight': float(minWeight) if minWeight is not None else None,
+			'massFraction': float(massFraction) if massFraction is not None else None,
+		}
+	except (TypeError, ValueError):
+		raise ValueError("Invalid query-term budget")
+
+	# An unlimited budget is expressed by omitting a limit, not by zero or negative values
+	if budget['maxTerms'] is not None and budget['maxTerms'] <= 0:
+		raise ValueError("max_query_terms must be a positive integer")
+	if budget['massFraction'] is not None and not 0 < budget['massFraction'] <= 1:
+		raise ValueError("term_mass_fraction must be in (0, 1]")
+	return budget
+
+def search_index(query, k, processor=None, budget=None, encoder=None):
+	processor = processor or SPARSE_QUERY_PROCESSOR
+	if processor not in PROCESSORS:
+		raise ValueError(f"Unknown query processor: {processor}")
+	encoder = encoder or SPARSE_QUERY_ENCODER
+	if encoder not in SPARSE_QUERY_ENCODERS:
+		raise ValueError(f"Unknown query encoder: {encoder}")
+
+	indices, weights = encode_query(query, encoder=encoder)
+	terms, weights = select_query_terms(indices, weights, **(budget or {}))
+	termStats = {'query_terms_total': len(indices), 'query_terms_used': len(terms)}
+	if len(terms) == 0:
+		return [], termStats
+
+	results, stats = sparseIndex.search(terms, weights, k, processor=processor)
+	return results, {**stats, **termStats, 'encoder': encoder}
+
+def embed_query(query):
+	# Only whitespace is normalized, as embeddings are case sensitive
+	text = " ".join(query.split())
+	embedding = embeddingCache.get(EMBEDDING_MODEL, text)
+	if embedding is None:
+		response = retryPolicy.call(
+			openaiClient.embeddings.create,
+			input=text,
+			model=EMBEDDING_MODEL
+		)
+		embedding = np.array(response.data[0].embedding, dtype=np.float32)
+		embeddingCache.put(EMBEDDING_MODEL, text, embedding)
+	return embedding
 
-	params = []
-	for idx, score in zip(indices, weights):
-		params.extend([int(idx), float(score)])
-	params.append(k)
+def dense_search_effort(data):
+	"""Reads the per-request search effort of approximate dense indices"""
+	try:
+		nprobe = data.get('nprobe')
+		efSearch = data.get('ef_search')
+		effort = {
+			'nprobe': int(nprobe) if nprobe is not None else None,
+			'efSearch': int(efSearch) if efSearch is not None else None,
+		}
+	except (TypeError, ValueError):
+		raise ValueError("Invalid dense search effort")
+
+	for name, value in (('nprobe', effort['nprobe']), ('ef_search', effort['efSearch'])):
+		if value is not None and value <= 0:
+			raise ValueError(f"{name} must be a positive integer")
+	return effort
+
+def search_dense_index(query, k, effort=None, scoring=None, topM=None):
+	embedding = embed_query(query)
+	effort = effort or {}
+	effortKey = (effort.get('nprobe'), effort.get('efSearch'))
+	scoring = scoring or DENSE_DOCUMENT_SCORING
+	if scoring not in DOCUMENT_SCORING:
+		raise ValueError(f"Unknown document scoring: {scoring}")
+	topM = topM or DENSE_SCORING_TOP_M
+
+	maxFetch = min(max(DENSE_MAX_FETCH, k), denseIndex.ntotal)
+	fetch = min(k * DENSE_OVERFETCH, maxFetch)
+	while True:
+		distances, identifiers = denseSearchBatcher.submit((embedding, fetch, effortKey))
+		results = aggregate_documents(distances[0], identifiers[0], indexDocumentMap, scoring=scoring, topM=topM)
+		if len(results) >= k or fetch >= maxFetch:
+			return results[:k]
+		fetch = min(fetch * 2, maxFetch)
+
+def search_dense_batch(items):
+	"""Runs one FAISS search per search effort for a batch of (embedding, k, effort) items"""
+	groups = {}
+	for i, (_, _, effort) in enumerate(items):
+		groups.setdefault(effort, []).append(i)
+
+	results = [None] * len(items)
+	for (nprobe, efSearch), members in groups.items():
+		embeddings = np.stack([items[i][0] for i in members])
+		distances, identifiers = denseIndex.search(embeddings, max(items[i][1] for i in members), nprobe=nprobe, efSearch=efSearch)
+		for row, i in enumerate(members):
+			k = items[i][1]
+			results[i] = (distances[row:row + 1, :k], identifiers[row:row + 1, :k])
+	return results
 
-	values_placeholders = ', '.join(['(?,?)'] * len(indices))
+queryVectorCache = LRUCache(
+	maxEntries=QUERY_CACHE_MAX_ENTRIES,
+	maxBytes=QUERY_CACHE_MAX_BYTES,
+	sizeof=lambda vector: vector[0].nbytes + vector[1].nbytes + 200
+)
+
+# Shared by all requests, so that concurrent searches queue their extractions in arrival order
+extractionExecutor = ThreadPoolExecutor(max_workers=EXTRACTION_CONCURRENCY, thread_name_prefix="extraction")
+
+documentCache = DocumentCache(
+	download_processed_mmd_file,
+	MMD_CACHE_DIR,
+	maxBytes=MMD_CACHE_MAX_BYTES,
+	memoryEntries=MMD_CACHE_MEMORY_ENTRIES,
+	memoryBytes=MMD_CACHE_MEMORY_BYTES,
+	compress=MMD_CACHE_COMPRESS
+)
+
+extractionCache = ExtractionCache(EXTRACTION_CACHE_PATH, ttlSeconds=EXTRACTION_CACHE_TTL)
+print(f"Deleted {extractionCache.invalidate(keepVersion=EXTRACTION_VERSION)} cached extractions of earlier versions")
+
+embeddingCache = EmbeddingCache(
+	EMBEDDING_CACHE_DIR,
+	EMBEDDING_DIMENSIONS,
+	capacity=EMBEDDING_CACHE_CAPACITY,
+	memoryEntries=EMBEDDING_CACHE_MEMORY_ENTRIES
+)
+
+# Concurrent requests share SPLADE forward passes and FAISS searches
+queryEncoderBatcher = MicroBatcher(encode_queries, maxBatchSize=QUERY_BATCH_MAX_SIZE, maxWaitMs=QUERY_BATCH_WAIT_MS)
+denseSearchBatcher = MicroBatcher(search_dense_batch, maxBatchSize=QUERY_BATCH_MAX_SIZE, maxWaitMs=QUERY_BATCH_WAIT_MS)
+
+searchExecutor = ThreadPoolExecutor(max_workers=SEARCH_EXECUTOR_WORKERS, thread_name_prefix="search")
+
+def run_search_legs(legs):
+	"""
+	Runs search legs concurrently, each against its own deadline.
+
+	Args:
+		legs (dict): Name to (function, arguments, timeout in milliseconds).
+
+	Returns:
+		tuple: Results of the legs that completed, and the status of every leg
+			("ok", "timeout" or "error").
+	"""
+
+	start = perf_counter()
+	futures = {name: searchExecutor.submit(function, *arguments) for name, (function, arguments, _) in legs.items()}
+
+	results = {}
+	status = {}
+	for name, future in futures.items():
+		remaining = legs[name][2] / 1000 - (perf_counter() - start)
+		try:
+			results[name] = future.result(timeout=max(remaining, 0))
+			status[name] = "ok"
+		except FutureTimeoutError:
+			# A running leg cannot be interrupted; it finishes in the background and is discarded
+			future.cancel()
+			status[name] = "timeout"
+		except ValueError:
+			raise
+		except Exception:
+			print_exc()
+			status[name] = "error"
+
+	if len(results) == 0 or (HYBRID_DEGRADE_POLICY == "fail" and len(results) < len(legs)):
+		raise TimeoutError(f"Search legs did not complete: {status}")
+	return results, status
+
+def fusion_options(data):
+	"""Reads the per-request fusion strategy and weights, falling back to the service defaults"""
+	strategy = data.get('fusion', FUSION_STRATEGY)
+	if strategy not in FUSION_STRATEGIES:
+		raise ValueError(f"Unknown fusion strategy: {strategy}")
+	try:
+		weights = data.get('fusion_weights') or {}
+		options = {
+			'strategy': strategy,
+			'rrfK': float(data.get('rrf_k', FUSION_RRF_K)),
+			'weights': {
+				'sparse': float(weights.get('sparse', FUSION_SPARSE_WEIGHT)),
+				'dense': float(weights.get('dense', FUSION_DENSE_WEIGHT)),
+			},
+		}
+	except (AttributeError, TypeError, ValueError):
+		raise ValueError("Invalid fusion options")
 
-	sql_query = f'''
-		WITH query_terms(term, score) AS (
-			VALUES {values_placeholders}
-		)
-		SELECT
-			d.filename AS document,
-			SUM(idx.score * q.score) AS total_score
-		FROM
-			inverted_index AS idx
-		JOIN
-			query_terms AS q ON idx.term = q.term
-		JOIN
-			documents AS d ON idx.document_id = d.id
-		GROUP BY
-			idx.document_id, d.filename
-		ORDER BY
-			total_score DESC
-		LIMIT ?
-	'''
-
-	cursor.execute(sql_query, params)
-	return cursor.fetchall()
-
-def search_dense_index(query, k):
-	response = openaiClient.embeddings.create(
-		input=query,
-		model="text-embedding-3-large"
-	)
-	embedding = np.array(response.data[0].embedding, dtype=np.float32).reshape(1, -1)
-
-	distances, identifiers = denseIndex.search(embedding, k * 4)
-
-	documentIds = []
-	results = []
-	for i in range(identifiers.shape[1]):
-		document = indexDocumentMap[identifiers[0, i]]
-		if document not in documentIds:
-			documentIds.append(document)
-			results.append((document, float(1 / (distances[0, i] + 0.00000001))))
-
-	return results[:k]
-
-def reciprocal_rank_fusion(dense_results, sparse_results, k):
-	combinedDocumentIds = set(d for d, _ in dense_results).union(set(d for d, _ in sparse_results))
-
-	fusedScores = {}
-	for documentId in combinedDocumentIds:
-		rrfScore = 0.0
-		for i, (d, _) in enumerate(dense_results):
-			if documentId == d:
-				rank = i + 1
-				rrfScore += 1.0 / rank
-				break
-		for i, (d, _) in enumerate(sparse_results):
-			if documentId == d:
-				rank = i + 1
-				rrfScore += 1.0 / rank
-				break
-		fusedScores[documentId] = rrfScore
-
-	fusedScores = sorted(fusedScores.items(), key=lambda x: x[1], reverse=True)[:k]
-
-	return fusedScores
+	# A negative constant or weight inverts rankings, and non-finite values poison every score
+	if not 0 <= options['rrfK'] < float('inf'):
+		raise ValueError("rrf_k must be a non-negative number")
+	if not all(0 <= weight < float('inf') for weight in options['weights'].values()):
+		raise ValueError("fusion_weights must be non-negative numbers")
+	return options
 
 @app.route('/search/sparse', methods=['POST'])
 def search():
-	# Check if service is ready
-	readyCheck = check_service_ready()
+	# Check if service is ready; inference-free queries only need the tokenizer and the index
+	readyCheck = check_service_ready((request.get_json(silent=True) or {}).get('encoder', SPARSE_QUERY_ENCODER))
 	if readyCheck:
 		return readyCheck
 
@@ -282,7 +632,10 @@ def search():
 		if not query.strip():
 			return jsonify({'error': 'Query cannot be empty'}), 400
 
-		searchResults = search_index(query, k)
+		streaming = stream_mode(data)
+		searchResults, sparseStats = search_index(query, k, processor=data.get('processor'), budget=query_term_budget(data), encoder=data.get('encoder'))
+		if streaming:
+			return stream_search_results(searchResults, {'sparse_stats': sparseStats}, streaming)
 		extractedData = extract_results([r[0] for r in searchResults])
 
 		response = {
@@ -294,7 +647,8 @@ def search():
 					'extracted_data': results
 				}
 				for (filename, score), results in zip(searchResults, extractedData)
-			]
+			],
+			'sparse_stats': sparseStats
 		}
 
 		return jsonify(response)
@@ -324,7 +678,10 @@ def search_dense():
 		if not query.strip():
 			return jsonify({'error': 'Query cannot be empty'}), 400
 
-		searchResults = search_dense_index(query, k)
+		streaming = stream_mode(data)
+		searchResults = search_dense_index(query, k, effort=dense_search_effort(data), scoring=data.get('document_scoring'), topM=data.get('scoring_top_m'))
+		if streaming:
+			return stream_search_results(searchResults, {}, streaming)
 		extractedData = extract_results([r[0] for r in searchResults])
 
 		response = {
@@ -341,6 +698,8 @@ def search_dense():
 
 		return jsonify(response)
 
+	except ValueError as e:
+		return jsonify({'error': str(e)}), 400
 	except Exception as e:
 		print_exc()
 		return jsonify({'error': 'Internal server error'}), 500
@@ -365,11 +724,27 @@ def search_hybrid():
 			return jsonify({'error': 'Query cannot be empty'}), 400
 
 		fusionK = max(k * 4, 50)
+		fusion = fusion_options(data)
+		streaming = stream_mode(data)
+
+		legResults, legStatus = run_search_legs({
+			'sparse': (
+				search_index,
+				(query, fusionK, data.get('processor'), query_term_budget(data), data.get('encoder')),
+				HYBRID_SPARSE_TIMEOUT_MS
+			),
+			'dense': (
+				search_dense_index,
+				(query, fusionK, dense_search_effort(data), data.get('document_scoring'), data.get('scoring_top_m')),
+				HYBRID_DENSE_TIMEOUT_MS
+			),
+		})
+		sparseResults, sparseStats = legResults.get('sparse', ([], {}))
+		denseResults = legResults.get('dense', [])
 
-		sparseResults = search_index(query, fusionK)
-		denseResults = search_dense_index(query, fusionK)
-
-		searchResults = reciprocal_rank_fusion(denseResults, sparseResults, k)
+		searchResults = fuse({'dense': denseResults, 'sparse': sparseResults}, k, **fusion)
+		if streaming:
+			return stream_search_results(searchResults, {'sparse_stats': sparseStats, 'legs': legStatus}, streaming)
 		extractedData = extract_results([r[0] for r in searchResults])
 
 		response = {
@@ -381,17 +756,39 @@ def search_hybrid():
 					'extracted_data': results
 				}
 				for (filename, score), results in zip(searchResults, extractedData)
-			]
+			],
+			'sparse_stats': sparseStats,
+			'legs': legStatus
 		}
 
 		return jsonify(response)
 
 	except ValueError as e:
 		return jsonify({'error': str(e)}), 400
+	except TimeoutError as e:
+		return jsonify({'error': str(e)}), 504
 	except Exception as e:
 		print_exc()
 		return jsonify({'error': 'Internal server error'}), 500
 
+@app.route('/metrics', methods=['GET'])
+def metrics():
+	return jsonify({
+		'query_encoder': {'backend': QUERY_ENCODER_BACKEND, 'fp32_check': queryEncoderCheck},
+		'sqlite_connections': sqlitePool.connections if sqlitePool else 0,
+		'query_vector_cache': queryVectorCache.metrics(),
+		'embedding_cache': embeddingCache.metrics(),
+		'document_cache': documentCache.metrics(),
+		'extraction_rate_limits': rateLimiters.metrics(),
+		'llm_retries': retryPolicy.metrics(),
+		'extraction_cache': {**extractionCache.metrics(), 'version': EXTRACTION_VERSION},
+		'dense_index': denseIndex.describe() if denseIndex else None,
+		'dense_index_load': denseIndexLoad,
+		'resident_memory_bytes': resident_memory(),
+		'query_encoder_batching': queryEncoderBatcher.metrics(),
+		'dense_search_batching': denseSearchBatcher.metrics()
+	})
+
 @app.route('/extract', methods=['POST'])
 def extract():
 	try:
@@ -406,6 +803,8 @@ def extract():
 
 		return jsonify({'extracted_data': results})
 
+	except ValueError as e:
+		return jsonify({'error': str(e)}), 400
 	except Exception as e:
 		print_exc()
 		return jsonify({'error': 'Internal server error'}), 500
@@ -0,0 +1,206 @@
+import sys
+import sqlite3
+from time import perf_counter
+import numpy as np
+import torch
+from transformers import AutoTokenizer, AutoModelForMaskedLM
+
+MAX_QUERY_TOKENS = 512
+
+# Backend options, combined with "+" (e.g. "int8+trace"); "fp32" is plain eager mode
+BACKEND_OPTIONS = ("fp32", "int8", "compile", "trace")
+
+SAMPLE_QUERIES = [
+	"state of the art image segmentation",
+	"large language model instruction tuning",
+	"graph neural networks for molecular property prediction",
+	"speech recognition in low resource languages",
+	"object detection on COCO",
+	"retrieval-augmented generation for question answering",
+	"reinforcement learning for robotic manipulation",
+	"diffusion models for image generation",
+	"named entity recognition in biomedical text",
+	"time series forecasting with transformers",
+	"few-shot text classification",
+	"3d point cloud segmentation",
+]
+
+def configure_threads(numThreads=None, numInteropThreads=None):
+	if numThreads:
+		torch.set_num_threads(numThreads)
+	if numInteropThreads:
+		try:
+			torch.set_num_interop_threads(numInteropThreads)
+		except RuntimeError:
+			# Can only be set once, before any inter-op parallel work has started
+			print("Inter-op thread count is already fixed")
+
+class SpladeQueryEncoder:
+	"""
+	SPLADE query encoder with a selectable CPU inference backend.
+
+	Args:
+		modelPath (str): Directory of the masked language model.
+		backend (str): "fp32", or "+"-separated options of "int8" (dynamic
+			quantization of linear layers), "compile" (torch.compile) and
+			"trace" (TorchScript tracing).
+	"""
+
+	def __init__(self, modelPath, backend="fp32"):
+		options = set(backend.split("+"))
+		if not options <= set(BACKEND_OPTIONS) or ("compile" in options and "trace" in options):
+			raise ValueError(f"Unknown query encoder backend: {backend}")
+
+		self.backend = backend
+		self.tokenizer = AutoTokenizer.from_pretrained(modelPath)
+
+		if options == {"fp32"}:
+			model = AutoModelForMaskedLM.from_pretrained(modelPath, device_map="auto")
+		else:
+			model = AutoModelForMaskedLM.from_pretrained(modelPath, torchscript="trace" in options)
+		model.eval()
+		self.device = model.device
+
+		if "int8" in options:
+			model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+		if "trace" in options:
+			example = self.tokenizer(["example query", "a somewhat longer example query"], padding=True, return_tensors='pt')
+			with torch.inference_mode():
+				model = torch.jit.freeze(torch.jit.trace(model, (example['input_ids'], example['attention_mask'])))
+		elif "compile" in options:
+			model = torch.compile(model, dynamic=True)
+
+		self.model = model
+		self.traced = "trace" in options
+
+	def logits(self, tokens):
+		if self.traced:
+			return self.model(tokens['input_ids'], tokens['attention_mask'])[0]
+		return self.model(**tokens).logits
+
+	def encode(self, queries):
+		"""
+		Encodes a batch of queries with one padded forward pass.
+
+		Returns:
+			list: (indices, weights) per query, or a ValueError for queries that are too long.
+		"""
+
+		encoded = [self.tokenizer(query, padding=False, truncation=False) for query in queries]
+		valid = [i for i, tokens in enumerate(encoded) if len(tokens['input_ids']) <= MAX_QUERY_TOKENS]
+
+		results = [ValueError("Input text is too long")] * len(queries)
+		if len(valid) == 0:
+			return results
+
+		tokens = self.tokenizer.pad([encoded[i] for i in valid], padding=True, return_tensors='pt')
+		tokens = {k: v.to(self.device) for k, v in tokens.items() if k in ('input_ids', 'attention_mask', 'token_type_ids')}
+
+		with torch.inference_mode():
+			logits = self.logits(tokens)
+			vectors = torch.max(
+				torch.log(1 + torch.relu(logits)) * tokens['attention_mask'].unsqueeze(-1),
+				dim=1
+			)[0].float().cpu()
+
+		for i, vector in zip(valid, vectors):
+			indices = vector.nonzero().squeeze(-1)
+			results[i] = (indices.tolist(), vector[indices].tolist())
+
+		return results
+
+def load_term_weights(conn):
+	"""Reads the precomputed `term_weights` table into an array indexed by vocabulary id."""
+
+	rows = conn.execute("SELECT term, weight FROM term_weights").fetchall()
+	termWeights = np.zeros(max((term for term, _ in rows), default=-1) + 1, dtype=np.float32)
+	for term, weight in rows:
+		termWeights[term] = weight
+
+	return termWeights
+
+class InferenceFreeQueryEncoder:
+	"""
+	Sparse query encoder that skips the transformer forward pass.
+
+	Queries are tokenized with the SPLADE tokenizer and every distinct token
+	is weighted from a per-term table precomputed from the index statistics.
+
+	Args:
+		modelPath (str): Directory holding the SPLADE tokenizer files.
+		termWeights (np.ndarray): Weight of every vocabulary id.
+	"""
+
+	backend = "inference-free"
+
+	def __init__(self, modelPath, termWeights):
+		self.tokenizer = AutoTokenizer.from_pretrained(modelPath)
+		self.termWeights = termWeights
+
+	def encode(self, queries):
+		results = []
+		for query in queries:
+			tokens = self.tokenizer(query, add_special_tokens=False, padding=False, truncation=False)['input_ids']
+			if len(tokens) + 2 > MAX_QUERY_TOKENS:
+				results.append(ValueError("Input text is too long"))
+				continue
+
+			# Queries of characters the tokenizer drops have no tokens, which must still index as integers
+			terms = np.unique(np.asarray(tokens, dtype=np.int64))
+			terms = terms[terms < len(self.termWeights)]
+			weights = self.termWeights[terms]
+			results.append((terms[weights > 0].tolist(), weights[weights > 0].tolist()))
+
+		return results
+
+def compare_rankings(encoder, reference, search, k=20, queries=SAMPLE_QUERIES):
+	"""
+	Compares the rankings produced by an encoder with those of a reference (fp32) encoder.
+
+	Args:
+		encoder: The encoder to check (SpladeQueryEncoder or InferenceFreeQueryEncoder).
+		reference (SpladeQueryEncoder): The fp32 encoder.
+		search: Function (terms, weights, k) returning ranked (document, score) tuples.
+		k (int): Ranking depth.
+		queries (list): Sample queries.
+
+	Returns:
+		dict: Mean overlap@k, share of queries with the same top document, and encoding latencies.
+	"""
+
+	overlaps = []
+	sameTop = []
+	latencies = {"encoder": [], "reference": []}
+	for query in queries:
+		start = perf_counter()
+		terms, weights = encoder.encode([query])[0]
+		latencies["encoder"].append(perf_counter() - start)
+		start = perf_counter()
+		referenceTerms, referenceWeights = reference.encode([query])[0]
+		latencies["reference"].append(perf_counter() - start)
+
+		results = [d for d, _ in search(terms, weights, k)]
+		expected = [d for d, _ in search(referenceTerms, referenceWeights, k)]
+		overlaps.append(len(set(results) & set(expected)) / max(len(expected), 1))
+		sameTop.append(results[:1] == expected[:1])
+
+	return {
+		"backend": encoder.backend,
+		f"overlap_at_{k}": sum(overlaps) / len(overlaps),
+		"same_top_document": sum(sameTop) / len(sameTop),
+		"encode_ms": sum(latencies["encoder"]) / len(queries) * 1000,
+		"reference_encode_ms": sum(latencies["reference"]) / len(queries) * 1000,
+	}
+
+if __name__ == "__main__":
+	# Checks every backend against fp32: python query_encoder.py <model dir> sparse_index.db
+	from sparse_index import InMemorySparseIndex
+
+	conn = sqlite3.connect(sys.argv[2])
+	index = InMemorySparseIndex.from_sqlite(conn)
+	search = lambda terms, weights, k: index.search(terms, weights, k)[0]
+	reference = SpladeQueryEncoder(sys.argv[1])
+	for backend in ["int8", "trace", "int8+trace", "compile", "int8+compile"]:
+		print(compare_rankings(SpladeQueryEncoder(sys.argv[1], backend=backend), reference, search))
+	print(compare_rankings(InferenceFreeQueryEncoder(sys.argv[1], load_term_weights(conn)), reference, search))
@@ -0,0 +1,107 @@
+import threading
+from time import monotonic
+from collections import deque
+
+class RateLimiter:
+	"""
+	Token buckets of requests and tokens per minute, served in arrival order.
+
+	Both buckets start full and refill continuously. A caller waits until
+	both hold enough for its request, and callers behind it wait their turn,
+	so a large request is not starved by a stream of small ones.
+
+	Args:
+		requestsPerMinute (float): Request rate; None is unlimited.
+		tokensPerMinute (float): Token rate; None is unlimited.
+	"""
+
+	def __init__(self, requestsPerMinute=None, tokensPerMinute=None):
+		self.rates = [rate / 60 if rate else None for rate in (requestsPerMinute, tokensPerMinute)]
+		self.capacities = [requestsPerMinute, tokensPerMinute]
+		self.levels = [capacity or 0 for capacity in self.capacities]
+		self.updated = monotonic()
+
+		self.condition = threading.Condition()
+		self.queue = deque()
+		self.waiting = 0
+		self.waitedSeconds = 0.0
+
+	def refill(self):
+		now = monotonic()
+		for i, rate in enumerate(self.rates):
+			if rate:
+				self.levels[i] = min(self.capacities[i], self.levels[i] + (now - self.updated) * rate)
+		self.updated = now
+
+	def acquire(self, tokens=0):
+		"""
+		Blocks until one request of `tokens` estimated tokens may be sent.
+
+		Returns:
+			float: Seconds waited.
+		"""
+
+		start = monotonic()
+		ticket = object()
+		# Requests larger than a full bucket would never fit
+		amounts = [1, min(tokens, self.capacities[1] or tokens)]
+
+		with self.condition:
+			self.queue.append(ticket)
+			self.waiting += 1
+			while True:
+				if self.queue[0] is ticket:
+					self.refill()
+					wait = max(
+						[(amount - level) / rate for amount, level, rate in zip(amounts, self.levels, self.rates) if rate and level < amount],
+						default=0
+					)
+					if wait <= 0:
+						break
+					self.condition.wait(wait)
+				else:
+					self.condition.wait()
+
+			for i, rate in enumerate(self.rates):
+				if rate:
+					self.levels[i] -= amounts[i]
+			self.queue.popleft()
+			self.waiting -= 1
+			waited = monotonic() - start
+			self.waitedSeconds += waited
+			self.condition.notify_all()
+
+		return waited
+
+	def metrics(self):
+		with self.condition:
+			return {
+				'waiting': self.waiting,
+				'waited_seconds': self.waitedSeconds,
+			}
+
+class RateLimiters:
+	"""
+	One `RateLimiter` per provider and model, created on first use.
+
+	Args:
+		limits (dict): Model name to {"rpm": ..., "tpm": ...}; models without limits are unlimited.
+	"""
+
+	def __init__(self, limits):
+		self.limits = limits
+		self.limiters = {}
+		self.lock = threading.Lock()
+
+	def get(self, provider, model):
+		with self.lock:
+			key = f"{provider}/{model}"
+			if key not in self.limiters:
+				limits = self.limits.get(model, {})
+				self.limiters[key] = RateLimiter(limits.get("rpm"), limits.get("tpm"))
+			return self.limiters[key]
+
+	def metrics(self):
+		with self.lock:
+			limiters = dict(self.limiters)
+		return {key: limiter.metrics() for key, limiter in limiters.items()}
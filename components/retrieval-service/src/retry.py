@@ -0,0 +1,170 @@
+import threading
+from time import sleep
+from random import uniform
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+from collections import deque
+import numpy as np
+
+# Timeouts, conflicts, rate limits and server errors are transient; other client errors are not
+RETRYABLE_STATUS_CODES = {408, 409, 429}
+
+def status_code(error):
+	"""HTTP status of an OpenAI (`status_code`) or Gemini (`code`) API error, if any"""
+	for attribute in ("status_code", "code"):
+		code = getattr(error, attribute, None)
+		if isinstance(code, int):
+			return code
+	return None
+
+def retry_after(error):
+	"""Delay in seconds requested by the provider through Retry-After headers, if any"""
+	headers = getattr(getattr(error, "response", None), "headers", None)
+	if not headers:
+		return None
+
+	try:
+		if headers.get("retry-after-ms"):
+			return float(headers["retry-after-ms"]) / 1000
+		value = headers.get("retry-after")
+		if value is None:
+			return None
+		try:
+			return float(value)
+		except ValueError:
+			# HTTP date form
+			return max((parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds(), 0)
+	except (TypeError, ValueError):
+		return None
+
+class RetryPolicy:
+	"""
+	Retries transient LLM API errors with exponential backoff and full jitter.
+
+	Errors with a retryable HTTP status, connection errors and timeouts are
+	retried; other errors, such as invalid requests or authentication
+	failures, are raised immediately. A provider's Retry-After delay replaces
+	the backoff when it is given.
+
+	Args:
+		maxAttempts (int): Attempts including the first call.
+		baseDelay (float): Backoff ceiling of the first retry, in seconds.
+		maxDelay (float): Upper bound of any delay, in seconds.
+	"""
+
+	def __init__(self, maxAttempts=5, baseDelay=0.5, maxDelay=30):
+		self.maxAttempts = maxAttempts
+		self.baseDelay = baseDelay
+		self.maxDelay = maxDelay
+
+		self.lock = threading.Lock()
+		self.retries = 0
+		self.failures = 0
+
+	def is_retryable(self, error):
+		code = status_code(error)
+		if code is not None:
+			return code in RETRYABLE_STATUS_CODES or code >= 500
+		return isinstance(error, (ConnectionError, TimeoutError)) or type(error).__name__ in ("APIConnectionError", "APITimeoutError")
+
+	def delay(self, attempt, error):
+		requested = retry_after(error)
+		if requested is not None:
+			return min(requested, self.maxDelay)
+		return uniform(0, min(self.baseDelay * 2**attempt, self.maxDelay))
+
+	def call(self, function, *args, maxAttempts=None, **kwargs):
+		maxAttempts = maxAttempts or self.maxAttempts
+		for attempt in range(maxAttempts):
+			try:
+				return function(*args, **kwargs)
+			except Exception as e:
+				if not self.is_retryable(e) or attempt == maxAttempts - 1:
+					with self.lock:
+						self.failures += 1
+					raise
+				delay = self.delay(attempt, e)
+				print(f"Retrying {getattr(function, '__name__', 'call')} in {delay:.2f}s after {type(e).__name__}: {e}")
+				with self.lock:
+					self.retries += 1
+				sleep(delay)
+
+	def metrics(self):
+		with self.lock:
+			return {
+				'retries': self.retries,
+				'failures': self.failures,
+			}
+
+class LatencyTracker:
+	"""
+	Recent latencies by key, for percentile thresholds.
+
+	Args:
+		window (int): Number of latencies kept per key.
+		minSamples (int): Number of latencies needed before a percentile is reported.
+	"""
+
+	def __init__(self, window=200, minSamples=20):
+		self.window = window
+		self.minSamples = minSamples
+		self.latencies = {}
+		self.lock = threading.Lock()
+
+	def record(self, key, seconds):
+		with self.lock:
+			self.latencies.setdefault(key, deque(maxlen=self.window)).append(seconds)
+
+	def percentile(self, key, q):
+		with self.lock:
+			latencies = list(self.latencies.get(key, ()))
+		if len(latencies) < self.minSamples:
+			return None
+		return float(np.percentile(latencies, q))
+
+def hedged_call(executor, primary, hedge, delay):
+	"""
+	Calls `primary` on the calling thread, and `hedge` on `executor` if the primary has not finished after `delay` seconds.
+
+	Only hedges take executor workers, so a caller's concurrency bound still
+	holds for primaries. The primary's result is returned when it succeeds, and
+	a hedge that has not started yet is cancelled. When the primary fails, the
+	hedge's result is awaited, or the hedge is called right away if the delay
+	has not passed. If both fail, the primary's error is raised.
+
+	Returns:
+		tuple: The result, and whether it came from the hedge.
+	"""
+
+	lock = threading.Lock()
+	hedgeFuture = None
+	primaryDone = False
+
+	def start_hedge():
+		nonlocal hedgeFuture
+		with lock:
+			if not primaryDone:
+				hedgeFuture = executor.submit(hedge)
+
+	timer = threading.Timer(delay, start_hedge)
+	timer.daemon = True
+	timer.start()
+	try:
+		result = primary()
+		primaryError = None
+	except Exception as e:
+		primaryError = e
+	finally:
+		timer.cancel()
+		with lock:
+			primaryDone = True
+
+	if primaryError is None:
+		if hedgeFuture is not None:
+			hedgeFuture.cancel()
+		return result, False
+
+	try:
+		return (hedge() if hedgeFuture is None else hedgeFuture.result()), True
+	except Exception:
+		raise primaryError
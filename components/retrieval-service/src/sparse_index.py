@@ -0,0 +1,668 @@
+import sys
+import json
+import mmap
+import sqlite3
+from bisect import bisect_left
+from heapq import heappush, heappushpop, heappop
+from time import perf_counter
+import numpy as np
+
+FETCH_SIZE = 1 << 16
+BLOCK_SIZE = 64
+
+# Upper bounds are inflated slightly so float rounding never prunes a document
+# that the exhaustive path would rank
+BOUND_SLACK = 1e-9
+
+PROCESSORS = ("exhaustive", "maxscore", "compare")
+
+# Compressed index file: magic, uint64 header length, JSON header, 64-byte aligned sections
+COMPRESSED_MAGIC = b"SPLADEIX"
+COMPRESSED_VERSION = 1
+SECTION_ALIGNMENT = 64
+
+def encode_varints(values):
+	"""
+	Encodes non-negative integers as LEB128 varints (7 bits per byte, high bit marks continuation).
+
+	Returns:
+		tuple: The encoded bytes and the number of bytes used by every value.
+	"""
+
+	values = np.asarray(values, dtype=np.int64)
+	numBytes = np.ones(len(values), dtype=np.int64)
+	for shift in (7, 14, 21, 28):
+		numBytes += values >= (1 << shift)
+
+	owners = np.repeat(np.arange(len(values)), numBytes)
+	ranks = np.arange(int(numBytes.sum())) - np.repeat(np.cumsum(numBytes) - numBytes, numBytes)
+	encoded = ((values[owners] >> (7 * ranks)) & 0x7f) | ((ranks < numBytes[owners] - 1).astype(np.int64) << 7)
+
+	return encoded.astype(np.uint8), numBytes
+
+def decode_varints(data):
+	"""Decodes a byte array holding complete LEB128 varints."""
+
+	ends = np.flatnonzero((data & 0x80) == 0)
+	if len(ends) == 0:
+		return np.zeros(0, dtype=np.int64)
+
+	starts = np.concatenate(([0], ends[:-1] + 1))
+	ranks = np.arange(len(data)) - np.repeat(starts, ends - starts + 1)
+	payload = (data & 0x7f).astype(np.int64) << (7 * ranks)
+
+	return np.add.reduceat(payload, starts)
+
+def quantize(scores, scales):
+	return np.clip(np.rint(scores / scales), 1, 255).astype(np.uint8)
+
+def select_query_terms(terms, weights, maxTerms=None, minWeight=None, massFraction=None):
+	"""
+	Applies a query-term budget to a sparse query vector.
+
+	Args:
+		terms (list): Vocabulary ids of the query terms.
+		weights (list): Query weights of the terms.
+		maxTerms (int): Keep at most this many of the highest weighted terms.
+		minWeight (float): Drop terms weighted below this threshold.
+		massFraction (float): Keep the highest weighted terms covering this fraction of the total weight.
+
+	Returns:
+		tuple: The kept terms and weights, in their original order.
+	"""
+
+	terms = np.asarray(terms, dtype=np.int64)
+	weights = np.asarray(weights, dtype=np.float64)
+
+	order = np.argsort(-weights, kind="stable")
+	keep = len(order)
+	if massFraction is not None and massFraction < 1 and keep > 0:
+		cumulative = np.cumsum(weights[order])
+		keep = int(np.searchsorted(cumulative, massFraction * cumulative[-1])) + 1
+	if maxTerms is not None:
+		keep = min(keep, maxTerms)
+
+	selected = np.zeros(len(terms), dtype=bool)
+	selected[order[:keep]] = True
+	if minWeight is not None:
+		selected &= weights >= minWeight
+
+	return terms[selected], weights[selected]
+
+def load_filenames(conn):
+	"""Reads the `documents` table into a list of filenames indexed by document id."""
+
+	documents = conn.execute("SELECT id, filename FROM documents").fetchall()
+	filenames = [None] * (max((row[0] for row in documents), default=-1) + 1)
+	for documentId, filename in documents:
+		filenames[documentId] = filename
+
+	return filenames
+
+def concatenate_ranges(starts, lengths):
+	"""Flat positions of all ranges [start, start + length) without a Python loop."""
+
+	total = int(lengths.sum())
+	return np.arange(total, dtype=np.int64) + np.repeat(starts - (np.cumsum(lengths) - lengths), lengths)
+
+class SparseIndex:
+	"""
+	Query processing shared by the in-process sparse index formats.
+
+	Subclasses provide posting `offsets`, `filenames`, block bounds
+	(`blockOffsets`, `blockMaxScores`, `blockLastDocumentIds`), `termMaxScores`,
+	and the `gather` and `postings` accessors.
+	"""
+
+	def query_terms(self, terms, weights):
+		terms = np.asarray(terms, dtype=np.int64)
+		weights = np.asarray(weights, dtype=np.float64)
+
+		inVocabulary = terms < self.vocabSize
+		return terms[inVocabulary], weights[inVocabulary]
+
+	def search(self, terms, weights, k, processor="exhaustive"):
+		"""
+		Scores a query with the selected query processor.
+
+		Args:
+			terms (list): Vocabulary ids of the query terms.
+			weights (list): Query weights of the terms.
+			k (int): Number of documents to return.
+			processor (str): "exhaustive", "maxscore", or "compare" to run both and check that their rankings match.
+
+		Returns:
+			tuple: (filename, score) tuples ordered by descending score, and a dict of query statistics.
+		"""
+
+		if processor == "exhaustive":
+			return self.search_exhaustive(terms, weights, k)
+		elif processor == "maxscore":
+			return self.search_maxscore(terms, weights, k)
+		elif processor == "compare":
+			start = perf_counter()
+			exhaustiveResults, exhaustiveStats = self.search_exhaustive(terms, weights, k)
+			exhaustiveTime = perf_counter() - start
+			start = perf_counter()
+			results, stats = self.search_maxscore(terms, weights, k)
+			maxscoreTime = perf_counter() - start
+
+			stats["rankings_match"] = [d for d, _ in results] == [d for d, _ in exhaustiveResults]
+			stats["exhaustive_ms"] = exhaustiveTime * 1000
+			stats["exhaustive_postings_scored"] = exhaustiveStats["postings_scored"]
+			stats["maxscore_ms"] = maxscoreTime * 1000
+			if not stats["rankings_match"]:
+				print(f"MaxScore ranking differs from exhaustive ranking: {results} != {exhaustiveResults}")
+			return results, stats
+
+		raise ValueError(f"Unknown query processor: {processor}")
+
+	def search_exhaustive(self, terms, weights, k):
+		"""Scores all postings of the query terms with a scatter-add into a dense accumulator."""
+
+		documentIds, contributions = self.gather(terms, weights)
+		stats = {"postings_scored": len(documentIds), "postings_skipped": 0}
+		if len(documentIds) == 0 or k <= 0:
+			return [], stats
+
+		accumulator = np.bincount(documentIds, weights=contributions, minlength=self.numDocuments)
+
+		return self.top_k(accumulator, k), stats
+
+	def search_maxscore(self, terms, weights, k):
+		"""
+		Document-at-a-time Block-Max MaxScore query processing.
+
+		Query terms are sorted by their score upper bound. Terms whose summed
+		bounds cannot lift a document above the current top-k threshold become
+		non-essential: they no longer produce candidates and are only probed,
+		block bound first, for documents found in the essential terms.
+		Documents are summed in query term order, so scores and ranking are
+		identical to the exhaustive path.
+		"""
+
+		terms, weights = self.query_terms(terms, weights)
+		lengths = self.offsets[terms + 1] - self.offsets[terms]
+		terms, weights = terms[lengths > 0], weights[lengths > 0]
+		totalPostings = int(lengths.sum())
+
+		if len(terms) == 0 or k <= 0:
+			return [], {"postings_scored": 0, "postings_skipped": totalPostings}
+
+		bounds = weights * self.termMaxScores[terms] * (1 + BOUND_SLACK)
+		order = np.argsort(bounds, kind="stable")
+		numLists = len(order)
+
+		# Lists in ascending bound order; prefix[i] bounds the sum over lists 0..i
+		listPositions = order.tolist()
+		listWeights = [float(weights[t]) for t in order]
+		prefix = np.cumsum(bounds[order]).tolist()
+		listDocuments = []
+		listScores = []
+		listBlockLast = []
+		listBlockMax = []
+		for i in order:
+			documentIds, scores = self.postings(terms[i])
+			blockStart, blockEnd = self.blockOffsets[terms[i]], self.blockOffsets[terms[i] + 1]
+			listDocuments.append(documentIds.tolist())
+			listScores.append(scores)
+			listBlockLast.append(self.blockLastDocumentIds[blockStart:blockEnd].tolist())
+			listBlockMax.append((self.blockMaxScores[blockStart:blockEnd].astype(np.float64) * float(weights[i]) * (1 + BOUND_SLACK)).tolist())
+
+		pointers = [0] * numLists
+		topK = []
+		threshold = 0.0
+		firstEssential = 0
+		postingsScored = 0
+
+		candidates = [(listDocuments[j][0], j) for j in range(numLists)]
+		candidates.sort()
+
+		while candidates:
+			# Entries of lists that turned non-essential no longer produce candidates
+			while candidates and candidates[0][1] < firstEssential:
+				heappop(candidates)
+			if not candidates:
+				break
+			document = candidates[0][0]
+
+			# Score the document in every essential list positioned on it
+			contributions = []
+			while candidates and candidates[0][0] == document:
+				_, j = heappop(candidates)
+				if j < firstEssential:
+					continue
+				contributions.append((listPositions[j], float(listScores[j][pointers[j]]) * listWeights[j]))
+				postingsScored += 1
+				pointers[j] += 1
+				if pointers[j] < len(listDocuments[j]):
+					heappush(candidates, (listDocuments[j][pointers[j]], j))
+
+			partial = sum(value for _, value in contributions)
+
+			# Probe non-essential lists, highest bound first
+			for j in range(firstEssential - 1, -1, -1):
+				if partial + prefix[j] <= threshold:
+					break
+
+				blockLast = listBlockLast[j]
+				blockSize = self.blockSize
+				block = bisect_left(blockLast, document, pointers[j] // blockSize)
+				if block == len(blockLast):
+					pointers[j] = len(listDocuments[j])
+					continue
+				if partial + listBlockMax[j][block] + (prefix[j - 1] if j > 0 else 0.0) <= threshold:
+					continue
+
+				low = max(pointers[j], block * blockSize)
+				position = bisect_left(listDocuments[j], document, low, min(low + blockSize, len(listDocuments[j])))
+				pointers[j] = position
+				if position < len(listDocuments[j]) and listDocuments[j][position] == document:
+					value = float(listScores[j][position]) * listWeights[j]
+					contributions.append((listPositions[j], value))
+					partial += value
+					postingsScored += 1
+					pointers[j] += 1
+			else:
+				# Fully scored: sum in query term order to match the exhaustive path
+				contributions.sort()
+				score = 0.0
+				for _, value in contributions:
+					score += value
+
+				if score > threshold:
+					if len(topK) < k:
+						heappush(topK, (score, -document))
+					else:
+						heappushpop(topK, (score, -document))
+					if len(topK) == k:
+						threshold = topK[0][0]
+						while firstEssential < numLists and prefix[firstEssential] <= threshold:
+							firstEssential += 1
+						if firstEssential == numLists:
+							break
+
+		results = sorted(topK, key=lambda entry: (-entry[0], -entry[1]))
+		stats = {"postings_scored": postingsScored, "postings_skipped": totalPostings - postingsScored}
+
+		return [(self.filenames[-documentId], score) for score, documentId in results], stats
+
+	def top_k(self, accumulator, k):
+		if k < len(accumulator):
+			# Keep every document tied with the k-th score so ties resolve by document id
+			kth = accumulator[np.argpartition(-accumulator, k - 1)[k - 1]]
+			candidates = np.flatnonzero(accumulator >= max(kth, np.nextafter(0, 1)))
+		else:
+			candidates = np.flatnonzero(accumulator > 0)
+
+		# Sort by descending score, ties broken by ascending document id
+		candidates = candidates[np.lexsort((candidates, -accumulator[candidates]))][:k]
+
+		return [(self.filenames[documentId], float(accumulator[documentId])) for documentId in candidates]
+
+class InMemorySparseIndex(SparseIndex):
+	"""
+	Inverted index held in contiguous NumPy arrays (CSR layout).
+
+	Postings of term `t` live in `documentIds[offsets[t]:offsets[t + 1]]` and
+	`scores[offsets[t]:offsets[t + 1]]`, sorted by document id. Every posting
+	list is split into blocks of `blockSize` postings whose maximum score and
+	last document id are kept for dynamic pruning.
+	"""
+
+	def __init__(self, offsets, documentIds, scores, filenames, blockSize=BLOCK_SIZE):
+		self.offsets = offsets
+		self.documentIds = documentIds
+		self.scores = scores
+		self.filenames = filenames
+		self.vocabSize = len(offsets) - 1
+		self.numDocuments = len(filenames)
+		self.blockSize = blockSize
+		self.build_bounds()
+
+	def build_bounds(self):
+		"""Precomputes per-term and per-block score upper bounds."""
+
+		lengths = np.diff(self.offsets)
+		numBlocks = (lengths + self.blockSize - 1) // self.blockSize
+
+		self.blockOffsets = np.zeros(self.vocabSize + 1, dtype=np.int64)
+		np.cumsum(numBlocks, out=self.blockOffsets[1:])
+
+		# Posting position where every block starts and ends
+		blockTerms = np.repeat(np.arange(self.vocabSize), numBlocks)
+		blockRanks = np.arange(self.blockOffsets[-1]) - self.blockOffsets[blockTerms]
+		blockStarts = self.offsets[blockTerms] + blockRanks * self.blockSize
+		blockEnds = np.minimum(blockStarts + self.blockSize, self.offsets[blockTerms + 1])
+
+		if len(blockStarts) > 0:
+			self.blockMaxScores = np.maximum.reduceat(self.scores, blockStarts)
+			self.blockLastDocumentIds = self.documentIds[blockEnds - 1]
+		else:
+			self.blockMaxScores = np.zeros(0, dtype=np.float32)
+			self.blockLastDocumentIds = np.zeros(0, dtype=np.int32)
+
+		self.termMaxScores = np.zeros(self.vocabSize, dtype=np.float32)
+		nonEmpty = numBlocks > 0
+		self.termMaxScores[nonEmpty] = np.maximum.reduceat(self.blockMaxScores, self.blockOffsets[:-1][nonEmpty])
+
+	@classmethod
+	def from_sqlite(cls, conn):
+		"""
+		Loads the `inverted_index` and `documents` tables of a sparse index database.
+
+		Args:
+			conn: An open sqlite3 connection to `sparse_index.db`.
+
+		Returns:
+			InMemorySparseIndex: The loaded index.
+		"""
+
+		cursor = conn.cursor()
+		filenames = load_filenames(conn)
+
+		cursor.execute("SELECT COUNT(*) FROM inverted_index")
+		numPostings = cursor.fetchone()[0]
+
+		terms = np.empty(numPostings, dtype=np.int32)
+		documentIds = np.empty(numPostings, dtype=np.int32)
+		scores = np.empty(numPostings, dtype=np.float32)
+
+		cursor.execute("SELECT term, document_id, score FROM inverted_index ORDER BY term, document_id")
+		position = 0
+		while True:
+			rows = cursor.fetchmany(FETCH_SIZE)
+			if not rows:
+				break
+			block = np.array(rows, dtype=np.float64)
+			terms[position:position + len(rows)] = block[:, 0]
+			documentIds[position:position + len(rows)] = block[:, 1]
+			scores[position:position + len(rows)] = block[:, 2]
+			position += len(rows)
+
+		vocabSize = int(terms.max()) + 1 if numPostings > 0 else 0
+		offsets = np.zeros(vocabSize + 1, dtype=np.int64)
+		np.cumsum(np.bincount(terms, minlength=vocabSize), out=offsets[1:])
+
+		return cls(offsets, documentIds, scores, filenames)
+
+	def gather(self, terms, weights):
+		"""
+		Collects the postings of all query terms into flat arrays.
+
+		Returns:
+			tuple: Document ids and weighted scores of every posting, in query term order.
+		"""
+
+		terms, weights = self.query_terms(terms, weights)
+
+		starts = self.offsets[terms]
+		lengths = self.offsets[terms + 1] - starts
+		positions = concatenate_ranges(starts, lengths)
+
+		return self.documentIds[positions], self.scores[positions] * np.repeat(weights, lengths)
+
+	def postings(self, term):
+		start, end = self.offsets[term], self.offsets[term + 1]
+		return self.documentIds[start:end], self.scores[start:end]
+
+def write_compressed_index(index, path):
+	"""
+	Writes an in-memory index in the compressed, memory-mappable format.
+
+	Document ids are delta-encoded within every posting list and stored as
+	varints, scores are quantized to 8-bit impacts with one linear scale per
+	term, and the term dictionary holds the posting and byte offsets of every
+	term. Block bounds are stored as impacts so they stay valid upper bounds
+	of the dequantized scores.
+
+	Args:
+		index (InMemorySparseIndex): The index to convert.
+		path (str): Output file path.
+	"""
+
+	lengths = np.diff(index.offsets)
+	nonEmpty = lengths > 0
+	postingTerms = np.repeat(np.arange(index.vocabSize), lengths)
+	blockTerms = np.repeat(np.arange(index.vocabSize), np.diff(index.blockOffsets))
+
+	scales = np.where(index.termMaxScores > 0, index.termMaxScores / 255, 1).astype(np.float32)
+	impacts = quantize(index.scores, scales[postingTerms])
+	blockMaxImpacts = quantize(index.blockMaxScores, scales[blockTerms])
+
+	# The first posting of every term keeps its absolute document id
+	deltas = index.documentIds.astype(np.int64)
+	deltas[1:] -= index.documentIds[:-1]
+	firstPostings = index.offsets[:-1][nonEmpty]
+	deltas[firstPostings] = index.documentIds[firstPostings]
+	documentBytes, numBytes = encode_varints(deltas)
+	byteOffsets = np.concatenate(([0], np.cumsum(numBytes)))[index.offsets]
+
+	encodedFilenames = [(filename or "").encode("utf-8") for filename in index.filenames]
+	filenameOffsets = np.zeros(len(encodedFilenames) + 1, dtype=np.int64)
+	np.cumsum([len(filename) for filename in encodedFilenames], out=filenameOffsets[1:])
+	filenameBytes = np.frombuffer(b"".join(encodedFilenames), dtype=np.uint8)
+
+	sections = {
+		"offsets": index.offsets.astype(np.int64),
+		"byteOffsets": byteOffsets.astype(np.int64),
+		"scales": scales,
+		"blockOffsets": index.blockOffsets.astype(np.int64),
+		"blockMaxImpacts": blockMaxImpacts,
+		"blockLastDocumentIds": index.blockLastDocumentIds.astype(np.uint32),
+		"documentBytes": documentBytes,
+		"impacts": impacts,
+		"filenameOffsets": filenameOffsets,
+		"filenameBytes": filenameBytes,
+	}
+
+	header = {
+		"version": COMPRESSED_VERSION,
+		"blockSize": index.blockSize,
+		"vocabSize": index.vocabSize,
+		"numDocuments": index.numDocuments,
+		"numPostings": len(index.documentIds),
+		"sections": {},
+	}
+
+	# Section offsets depend on the header length, so lay them out after a padded header
+	headerSize = SECTION_ALIGNMENT * 64
+	position = headerSize
+	for name, array in sections.items():
+		header["sections"][name] = {"offset": position, "dtype": array.dtype.str, "count": len(array)}
+		position += -(-array.nbytes // SECTION_ALIGNMENT) * SECTION_ALIGNMENT
+
+	encodedHeader = json.dumps(header).encode("utf-8")
+	if len(COMPRESSED_MAGIC) + 8 + len(encodedHeader) > headerSize:
+		raise ValueError("Compressed index header does not fit")
+
+	with open(path, "wb") as f:
+		f.write(COMPRESSED_MAGIC)
+		f.write(np.uint64(len(encodedHeader)).tobytes())
+		f.write(encodedHeader)
+		for name, array in sections.items():
+			f.seek(header["sections"][name]["offset"])
+			f.write(np.ascontiguousarray(array).tobytes())
+		f.truncate(position)
+
+class CompressedSparseIndex(SparseIndex):
+	"""
+	Read-only view of a compressed index file written by `write_compressed_index`.
+
+	The file is memory-mapped, so worker processes share one copy in the page
+	cache; posting lists of the query terms are decoded at query time.
+	"""
+
+	def __init__(self, path):
+		self.file = open(path, "rb")
+		self.buffer = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+
+		if self.buffer[:len(COMPRESSED_MAGIC)] != COMPRESSED_MAGIC:
+			raise ValueError(f"{path} is not a compressed sparse index")
+		headerLength = int(np.frombuffer(self.buffer, dtype=np.uint64, count=1, offset=len(COMPRESSED_MAGIC))[0])
+		headerStart = len(COMPRESSED_MAGIC) + 8
+		header = json.loads(self.buffer[headerStart:headerStart + headerLength].decode("utf-8"))
+		if header["version"] != COMPRESSED_VERSION:
+			raise ValueError(f"Unsupported compressed index version: {header['version']}")
+
+		sections = {
+			name: np.frombuffer(self.buffer, dtype=np.dtype(section["dtype"]), count=section["count"], offset=section["offset"])
+			for name, section in header["sections"].items()
+		}
+
+		self.blockSize = header["blockSize"]
+		self.vocabSize = header["vocabSize"]
+		self.numDocuments = header["numDocuments"]
+		self.offsets = sections["offsets"]
+		self.byteOffsets = sections["byteOffsets"]
+		self.scales = sections["scales"]
+		self.blockOffsets = sections["blockOffsets"]
+		self.blockLastDocumentIds = sections["blockLastDocumentIds"]
+		self.documentBytes = sections["documentBytes"]
+		self.impacts = sections["impacts"]
+
+		blockTerms = np.repeat(np.arange(self.vocabSize), np.diff(self.blockOffsets))
+		self.blockMaxScores = sections["blockMaxImpacts"].astype(np.float32) * self.scales[blockTerms]
+		self.termMaxScores = np.zeros(self.vocabSize, dtype=np.float32)
+		nonEmpty = np.diff(self.blockOffsets) > 0
+		if nonEmpty.any():
+			self.termMaxScores[nonEmpty] = np.maximum.reduceat(self.blockMaxScores, self.blockOffsets[:-1][nonEmpty])
+
+		filenameOffsets = sections["filenameOffsets"]
+		filenameBytes = sections["filenameBytes"].tobytes()
+		self.filenames = [
+			filenameBytes[filenameOffsets[i]:filenameOffsets[i + 1]].decode("utf-8") or None
+			for i in range(self.numDocuments)
+		]
+
+	def decode(self, terms):
+		"""Decodes the document ids and dequantized scores of the given terms, concatenated in order."""
+
+		starts = self.offsets[terms]
+		lengths = self.offsets[terms + 1] - starts
+		byteStarts = self.byteOffsets[terms]
+
+		deltas = decode_varints(self.documentBytes[concatenate_ranges(byteStarts, self.byteOffsets[terms + 1] - byteStarts)])
+
+		# Prefix sums restart at the first posting of every term
+		totals = np.cumsum(deltas)
+		segmentStarts = np.cumsum(lengths) - lengths
+		documentIds = totals - np.repeat(np.concatenate(([0], totals))[segmentStarts], lengths)
+
+		scores = self.impacts[concatenate_ranges(starts, lengths)].astype(np.float32) * np.repeat(self.scales[terms], lengths)
+
+		return documentIds, scores
+
+	def gather(self, terms, weights):
+		terms, weights = self.query_terms(terms, weights)
+		documentIds, scores = self.decode(terms)
+		lengths = self.offsets[terms + 1] - self.offsets[terms]
+
+		return documentIds, scores * np.repeat(weights, lengths)
+
+	def postings(self, term):
+		return self.decode(np.array([term], dtype=np.int64))
+
+class BlobSparseIndex(SparseIndex):
+	"""
+	Reads posting lists stored as one row per term in the `posting_lists` table.
+
+	Each row holds the packed int32 document ids and float32 scores of a term,
+	so a query costs one row fetch per query term. Only exhaustive query
+	processing is supported, as no block bounds are stored.
+
+	Args:
+		pool (SqliteConnectionPool): Connections to `sparse_index.db`.
+	"""
+
+	def __init__(self, pool):
+		self.pool = pool
+		with pool.connection() as conn:
+			self.filenames = load_filenames(conn)
+		self.numDocuments = len(self.filenames)
+		maxTerm = pool.fetchall("SELECT MAX(term) FROM posting_lists")[0][0]
+		self.vocabSize = maxTerm + 1 if maxTerm is not None else 0
+
+	def fetch(self, terms):
+		"""Fetches the posting lists of the given terms as zero-copy NumPy views."""
+
+		uniqueTerms = sorted(set(int(term) for term in terms))
+		if len(uniqueTerms) == 0:
+			return {}
+
+		rows = self.pool.fetchall(
+			f"SELECT term, document_ids, scores FROM posting_lists WHERE term IN ({', '.join(['?'] * len(uniqueTerms))})",
+			uniqueTerms
+		)
+
+		return {
+			term: (np.frombuffer(documentIds, dtype=np.int32), np.frombuffer(scores, dtype=np.float32))
+			for term, documentIds, scores in rows
+		}
+
+	def gather(self, terms, weights):
+		terms, weights = self.query_terms(terms, weights)
+		postings = self.fetch(terms)
+
+		documentIds = [np.zeros(0, dtype=np.int32)]
+		contributions = [np.zeros(0, dtype=np.float64)]
+		for term, weight in zip(terms.tolist(), weights):
+			if term in postings:
+				documentIds.append(postings[term][0])
+				contributions.append(postings[term][1].astype(np.float64) * weight)
+
+		return np.concatenate(documentIds), np.concatenate(contributions)
+
+	def postings(self, term):
+		return self.fetch([term]).get(int(term), (np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.float32)))
+
+	def search_maxscore(self, terms, weights, k):
+		raise ValueError("The blob sparse index only supports exhaustive query processing")
+
+class SqliteSparseIndex:
+	"""
+	Scores queries inside SQLite by joining the query terms against `inverted_index`.
+
+	Args:
+		pool (SqliteConnectionPool): Connections to `sparse_index.db`.
+	"""
+
+	def __init__(self, pool):
+		self.pool = pool
+
+	def search(self, terms, weights, k, processor="exhaustive"):
+		if len(terms) == 0:
+			return [], {}
+
+		params = []
+		for idx, score in zip(terms, weights):
+			params.extend([int(idx), float(score)])
+		params.append(k)
+
+		values_placeholders = ', '.join(['(?,?)'] * len(terms))
+
+		sql_query = f'''
+			WITH query_terms(term, score) AS (
+				VALUES {values_placeholders}
+			)
+			SELECT
+				d.filename AS document,
+				SUM(idx.score * q.score) AS total_score
+			FROM
+				inverted_index AS idx
+			JOIN
+				query_terms AS q ON idx.term = q.term
+			JOIN
+				documents AS d ON idx.document_id = d.id
+			GROUP BY
+				idx.document_id, d.filename
+			ORDER BY
+				total_score DESC
+			LIMIT ?
+		'''
+
+		return self.pool.fetchall(sql_query, params), {}
+
+if __name__ == "__main__":
+	# Converts a SQLite sparse index: python sparse_index.py sparse_index.db sparse_index.spx
+	write_compressed_index(InMemorySparseIndex.from_sqlite(sqlite3.connect(sys.argv[1])), sys.argv[2])
@@ -0,0 +1,65 @@
+import threading
+import queue
+import sqlite3
+from os import path
+from contextlib import contextmanager
+
+# Upper bound of the page cache SQLite keeps on top of the memory map
+MAX_CACHE_BYTES = 256 * 2**20
+
+class SqliteConnectionPool:
+	"""
+	Bounded pool of read-only connections to an immutable SQLite database.
+
+	Connections are opened on demand, up to `maxConnections`, and checked back
+	in after every use, so threads that live for a single request still reuse
+	them. Callers beyond the bound wait for a connection to be checked in.
+	Connections are opened with `mode=ro&immutable=1` so SQLite skips locking
+	and change detection. The whole file is memory-mapped and the page cache
+	is sized to the database, up to `MAX_CACHE_BYTES`.
+
+	Args:
+		filepath (str): Path of the database file. It must not change while the pool is in use.
+		maxConnections (int): Maximum number of open connections.
+	"""
+
+	def __init__(self, filepath, maxConnections=8):
+		self.uri = f"file:{path.abspath(filepath)}?mode=ro&immutable=1"
+		size = path.getsize(filepath)
+		self.mmapSize = size
+		# Negative cache_size is in KiB
+		self.cacheSize = -max(min(size, MAX_CACHE_BYTES) // 1024, 2048)
+
+		# Most recently checked in first, so the warmest page caches are reused
+		self.idle = queue.LifoQueue()
+		self.slots = threading.BoundedSemaphore(maxConnections)
+		self.lock = threading.Lock()
+		self.connections = 0
+
+	def open(self):
+		# Connections move between threads, but only one uses a connection at a time
+		conn = sqlite3.connect(self.uri, uri=True, check_same_thread=False)
+		conn.execute(f"PRAGMA mmap_size = {self.mmapSize}")
+		conn.execute(f"PRAGMA cache_size = {self.cacheSize}")
+		conn.execute("PRAGMA query_only = 1")
+		with self.lock:
+			self.connections += 1
+		return conn
+
+	@contextmanager
+	def connection(self):
+		"""Checks out a connection for the duration of the `with` block"""
+
+		with self.slots:
+			try:
+				conn = self.idle.get_nowait()
+			except queue.Empty:
+				conn = self.open()
+			try:
+				yield conn
+			finally:
+				self.idle.put(conn)
+
+	def fetchall(self, sql, params=()):
+		with self.connection() as conn:
+			return conn.execute(sql, params).fetchall()